@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import aiohttp
+from cache import cache_key
+from client import RATE_METHOD_ERROR, SnoothClient
+from handlers import SnoothError, snooth_error_handler
+
+TRANSIENT_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+
+class AsyncSingleFlight(object):
+    """SingleFlight for coroutines: tasks asking for a key already being
+    fetched await the leader's result instead of sending a request.
+
+    The fetch runs as its own task, so cancelling the task that started
+    it does not cancel it for the others waiting on the key.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, fn, *args):
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(functools.partial(self._done, key))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved when nobody was left waiting.
+        if not task.cancelled():
+            task.exception()
+
+
+class AsyncSnoothClient(SnoothClient):
+    """asyncio version of SnoothClient backed by an aiohttp session.
+
+    Parameters are built and responses checked by the same helpers as the
+    blocking client; every endpoint is a coroutine. Use ``async with`` or
+    ``await client.close()`` to release the connection pool. Observers,
+    cassettes and revalidators are not supported.
+    """
+
+    UNSUPPORTED = ('observers', 'cassette', 'revalidator')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for option in self.UNSUPPORTED:
+            if getattr(self, option):
+                raise SnoothError(
+                    'AsyncSnoothClient does not support %s' % option
+                )
+        if self.inflight is not None:
+            self.inflight = AsyncSingleFlight()
+
+    def __enter__(self):
+        raise TypeError('Use "async with" with AsyncSnoothClient')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def transient_errors(self):
+        return TRANSIENT_ERRORS
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _build_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_connections * self.pool_maxsize,
+            limit_per_host=self.pool_maxsize,
+            force_close=not self.keep_alive
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    async def wine_search(self, q='wine', wineify=False, meta=False,
+                          count=10, page=1, first_result=None,
+                          available=False, prod_type=None, color=None,
+                          store_id=None, country=None, zipcode=None,
+                          lat=None, lng=None, sort=None, min_price=None,
+                          max_price=None, min_rank=None, max_rank=None,
+                          lang=None, timeout=None, batch=False):
+        params = self._wine_search_params(
+            q, count, page, first_result, available, prod_type, color,
+            store_id, country, zipcode, lat, lng, sort, min_price,
+            max_price, min_rank, max_rank, lang
+        )
+        timeout = self._get_timeout(timeout)
+        python_response = await self._read(
+            'wine_search', self.WINE_SEARCH_URL, params, timeout
+        )
+        return self._wine_search_output(python_response, wineify, meta,
+                                        batch)
+
+    async def iter_wine_search(self, q='wine', wineify=False, count=10,
+                               page=1, first_result=None, available=False,
+                               prod_type=None, color=None, store_id=None,
+                               country=None, zipcode=None, lat=None,
+                               lng=None, sort=None, min_price=None,
+                               max_price=None, min_rank=None,
+                               max_rank=None, lang=None, prefetch=False,
+                               timeout=None):
+        """Async generator over every wine matching the search, see
+        SnoothClient.iter_wine_search. Use with ``async for``."""
+        timeout = self._get_timeout(timeout)
+
+        def fetch_page(first_result):
+            params = self._wine_search_params(
+                q, count, page, first_result, available, prod_type, color,
+                store_id, country, zipcode, lat, lng, sort, min_price,
+                max_price, min_rank, max_rank, lang
+            )
+            return self._read(
+                'wine_search', self.WINE_SEARCH_URL, params, timeout
+            )
+
+        first_result = self._paginator(count, page, first_result)
+        pages = self._iter_pages(fetch_page, 'wines', count, first_result,
+                                 prefetch)
+        async for wines in pages:
+            if wineify is True:
+                wines = self.wineify(wines)
+            for wine in wines:
+                yield wine
+
+    async def wine_detail(self, wine_id, price=False, country=None,
+                          zipcode=None, pairings=False, photos=False,
+                          lat=None, lng=None, language=None, timeout=None):
+        params = self._wine_detail_params(
+            wine_id, price, country, zipcode, pairings, photos, lat, lng,
+            language
+        )
+        timeout = self._get_timeout(timeout)
+        python_response = await self._read(
+            'wine_detail', self.WINE_DETAIL_URL, params, timeout
+        )
+        return self._wine_detail_output(python_response)
+
+    async def wine_details(self, wine_ids, workers=None, **kwargs):
+        """Fetch several wines concurrently with wine_detail, at most
+        ``workers`` at a time. Returns ``(wines, errors)`` as
+        SnoothClient.wine_details does."""
+        lookups = self._wine_detail_lookups(list(wine_ids), workers, kwargs)
+        results = await asyncio.gather(*lookups)
+        return self._collect_details(results)
+
+    async def iter_wine_details(self, wine_ids, workers=None, **kwargs):
+        """Async generator of ``(wine_id, wine, error)`` tuples in
+        completion order, see SnoothClient.iter_wine_details."""
+        lookups = self._wine_detail_lookups(list(wine_ids), workers, kwargs)
+        tasks = [asyncio.ensure_future(lookup) for lookup in lookups]
+        try:
+            for lookup in asyncio.as_completed(tasks):
+                yield await lookup
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _wine_detail_lookups(self, wine_ids, workers, kwargs):
+        semaphore = asyncio.Semaphore(self._get_workers(workers))
+
+        async def fetch(wine_id):
+            async with semaphore:
+                try:
+                    wine = await self.wine_detail(wine_id, **kwargs)
+                except Exception as error:
+                    return wine_id, None, error
+                return wine_id, wine, None
+
+        return [fetch(wine_id) for wine_id in wine_ids]
+
+    async def my_wines(self, wineify=False, username=None, password=None,
+                       count=10, page=1, ratings=True, wishlist=True,
+                       cellar=True, timeout=None, batch=False):
+        params = self._my_wines_params(
+            username, password, count, page, ratings, wishlist, cellar
+        )
+        timeout = self._get_timeout(timeout)
+        response = await self.get(self.MY_WINES_URL, params, timeout)
+        python_response = self.parse_get_response(response)
+        return self._my_wines_output(python_response, wineify, batch)
+
+    async def winery_detail(self, winery_id, wineryify=False, timeout=None):
+        params = self._winery_detail_params(winery_id)
+        timeout = self._get_timeout(timeout)
+        python_response = await self._read(
+            'winery_detail', self.WINERY_DETAIL_URL, params, timeout
+        )
+        return self._winery_detail_output(python_response, wineryify)
+
+    async def rate_wine(self, wine_id, method='POST', username=None,
+                        password=None, rating=None, review=None,
+                        private=False, tags=None, wishlist=False,
+                        cellar_count=None, timeout=None):
+        params = self._rate_wine_params(
+            wine_id, username, password, rating, review, private, tags,
+            wishlist, cellar_count
+        )
+        timeout = self._get_timeout(timeout)
+        if method == 'POST':
+            response = await self.post(self.RATE_WINE_URL, params, timeout)
+        elif method == 'PUT':
+            response = await self.put(self.RATE_WINE_URL, params, timeout)
+        else:
+            raise SnoothError(RATE_METHOD_ERROR)
+        python_response = self.parse_post_response(response)
+        self._invalidate_wine(wine_id)
+        return python_response
+
+    async def wishlist(self, wine_id, username=None, password=None,
+                       timeout=None):
+        """Currently just adds to wine list"""
+        params = self._wishlist_params(wine_id, username, password)
+        timeout = self._get_timeout(timeout)
+        response = await self.post(self.WISHLIST_WINE_URL, params, timeout)
+        python_response = self.parse_post_response(response)
+        self._invalidate_wine(wine_id)
+        return python_response
+
+    async def store_search(self, country=None, zipcode=None, storeify=False,
+                           meta=False, lat=None, lng=None, timeout=None):
+        params = self._store_search_params(country, zipcode, lat, lng)
+        timeout = self._get_timeout(timeout)
+        python_response = await self._read(
+            'store_search', self.STORE_SEARCH_URL, params, timeout
+        )
+        return self._store_search_output(python_response, storeify, meta)
+
+    async def store_detail(self, store_id, reviews=True, timeout=None):
+        params = self._store_detail_params(store_id, reviews)
+        timeout = self._get_timeout(timeout)
+        python_response = await self._read(
+            'store_detail', self.STORE_DETAIL_URL, params, timeout
+        )
+        return self._detail_output(python_response, 'store')
+
+    async def create_account(self, email=None, screen_name=None,
+                             password=None, timeout=None):
+        params = self._create_account_params(email, screen_name, password)
+        timeout = self._get_timeout(timeout)
+        response = await self.post(self.CREATE_ACCOUNT_URL, params, timeout)
+        python_response = self.parse_post_response(response)
+        return python_response
+
+    async def user_activity(self, activity_type=None, before_date='now',
+                            count=50, page=1, first_result=1, timeout=None):
+        params = self._user_activity_params(
+            before_date, count, page, first_result
+        )
+        timeout = self._get_timeout(timeout)
+        response = await self.get(self.USER_ACTIVITY_URL, params, timeout)
+        python_response = self.parse_get_response(response)
+        return self._detail_output(python_response, 'actions')
+
+    async def iter_user_activity(self, before_date='now', count=50,
+                                 page=1, first_result=None, prefetch=False,
+                                 timeout=None):
+        """Async generator over user actions, see iter_wine_search."""
+        timeout = self._get_timeout(timeout)
+
+        async def fetch_page(first_result):
+            params = self._user_activity_params(
+                before_date, count, page, first_result
+            )
+            response = await self.get(self.USER_ACTIVITY_URL, params,
+                                      timeout)
+            return self.parse_get_response(response)
+
+        first_result = self._paginator(count, page, first_result)
+        pages = self._iter_pages(fetch_page, 'actions', count, first_result,
+                                 prefetch)
+        async for actions in pages:
+            for action in actions:
+                yield action
+
+    async def get(self, url, params, timeout):
+        return await self._request('GET', url, params, timeout)
+
+    async def post(self, url, params, timeout):
+        return await self._request('POST', url, params, timeout)
+
+    async def put(self, url, params, timeout):
+        return await self._request('PUT', url, params, timeout)
+
+    async def _read(self, endpoint, url, params, timeout):
+        key = cache_key(endpoint, params)
+        if self.cache is not None:
+            python_response = self.cache.get(key)
+            if python_response is not None:
+                return python_response
+        if self.inflight is not None:
+            return await self.inflight.do(key, self._fetch, key, url,
+                                          params, timeout)
+        return await self._fetch(key, url, params, timeout)
+
+    async def _fetch(self, key, url, params, timeout):
+        response = await self.get(url, params, timeout)
+        python_response = self.parse_get_response(response)
+        if self.cache is not None:
+            self.cache.set(key, python_response)
+        return python_response
+
+    async def _iter_pages(self, fetch_page, key, count, first_result,
+                          prefetch):
+        """Async version of SnoothClient._iter_pages, ``fetch_page``
+        returns an awaitable. With ``prefetch`` the next page is fetched
+        in a task while the current one is consumed."""
+        pending = None
+        try:
+            python_response = await fetch_page(first_result)
+            while True:
+                items, next_result, more = self._next_page(
+                    python_response, key, first_result
+                )
+                if more and prefetch:
+                    pending = asyncio.ensure_future(fetch_page(next_result))
+                if items:
+                    yield items
+                if not more:
+                    break
+                if pending is not None:
+                    python_response = await pending
+                    pending = None
+                else:
+                    python_response = await fetch_page(next_result)
+                first_result = next_result
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def _request(self, method, url, params, timeout):
+        """Send the request through the circuit breaker, retrying GETs
+        according to the retry policy, and return the raw body."""
+        policy = self.retry if method == 'GET' else None
+        breaker = self.breaker
+        deadline = policy.start() if policy is not None else None
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.before()
+            if policy is not None:
+                attempt_timeout = policy.timeout(timeout, deadline)
+            else:
+                attempt_timeout = timeout
+            try:
+                body = await self._send(method, url, params, attempt_timeout)
+            except Exception as error:
+                transient = self.transient_errors()
+                if breaker is not None:
+                    breaker.record(error, transient)
+                delay = None
+                if policy is not None:
+                    delay = policy.delay(attempt, error, transient, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if breaker is not None:
+                breaker.success()
+            return body
+
+    async def _send(self, method, url, params, timeout):
+        """Send one request and return the raw body. Like
+        http_error_handler, anything but a 200 raises the HTTP error."""
+        # requests silently drops None params, aiohttp refuses them.
+        params = {
+            key: value for (key, value) in params.items()
+            if value is not None
+        }
+        if self.limiter is not None:
+            delay = self.limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        async with self.session.request(
+            method,
+            url,
+            params=params,
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            if response.status != 200:
+                response.raise_for_status()
+            return await response.read()
+
+    @snooth_error_handler(post='')
+    def parse_get_response(self, response):
+        return self.decoder.decode(response)
+
+    @snooth_error_handler(post='POST')
+    def parse_post_response(self, response):
+        return self.decoder.decode(response)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+import heapq
+from array import array
+from itertools import compress, count, repeat
+from operator import and_, eq, ge, itemgetter, le
+from regions import split_region
+try:
+    from itertools import imap
+except ImportError:
+    imap = map
+
+NAN = float('nan')
+
+# Set by _numpy, False when numpy is not installed.
+numpy = None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _numpy():
+    """numpy if it is installed, else None. Imported on first use so the
+    client does not pay for it at import time."""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            module = False
+        numpy = module
+    return numpy or None
+
+
+def _view(numpy, column):
+    """numpy array sharing the memory of the typed array ``column``."""
+    return numpy.frombuffer(column, dtype=column.typecode)
+
+
+def _gather(column, indices):
+    """Values of ``column`` at ``indices``, fetched by a C level
+    itemgetter rather than a Python loop."""
+    if len(indices) > 1:
+        return itemgetter(*indices)(column)
+    return [column[i] for i in indices]
+
+
+def _take_array(column, indices):
+    """Typed array of the values of typed array ``column`` at
+    ``indices``, a numpy index array when numpy is installed."""
+    numpy = _numpy()
+    if numpy is not None:
+        taken = _view(numpy, column)[indices]
+        return array(column.typecode, taken.tobytes())
+    return array(column.typecode, _gather(column, indices))
+
+
+class StringColumn(object):
+    """Dictionary encoded string column: each distinct string is stored
+    once and rows hold an integer code into ``values``."""
+
+    __slots__ = ('values', 'codes', '_index')
+
+    def __init__(self, values=None, index=None, codes=None):
+        self.values = values if values is not None else []
+        self._index = index if index is not None else {}
+        self.codes = codes if codes is not None else array('i')
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, position):
+        return self.values[self.codes[position]]
+
+    def __iter__(self):
+        values = self.values
+        for code in self.codes:
+            yield values[code]
+
+    def append(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def code(self, value):
+        """Code of ``value``, -1 when the column never saw it."""
+        return self._index.get(value, -1)
+
+    def take(self, indices):
+        return StringColumn(self.values, self._index,
+                            _take_array(self.codes, indices))
+
+
+class WineBatch(object):
+    """Column oriented page or stream of wine_search/my_wines results.
+
+    Numeric fields are typed arrays (missing prices and ranks are NaN,
+    missing vintages and counts 0), categorical fields are dictionary
+    encoded StringColumns with the region split into its levels. filter,
+    sort and top_k work a column at a time and return new batches; filter
+    conditions are evaluated together in one pass over the columns.
+    """
+
+    FLOAT_FIELDS = ('price', 'snoothrank')
+    INT_FIELDS = ('vintage', 'num_reviews', 'num_merchants')
+    STRING_FIELDS = (
+        'winery', 'winery_id', 'varietal', 'type', 'country', 'region',
+        'sub_region1', 'sub_region2'
+    )
+    TEXT_FIELDS = ('code', 'name')
+
+    def __init__(self):
+        self.columns = {}
+        for field in self.FLOAT_FIELDS:
+            self.columns[field] = array('d')
+        for field in self.INT_FIELDS:
+            self.columns[field] = array('i')
+        for field in self.STRING_FIELDS:
+            self.columns[field] = StringColumn()
+        for field in self.TEXT_FIELDS:
+            self.columns[field] = []
+        self.columns['available'] = array('b')
+
+    @classmethod
+    def from_wines(cls, wines):
+        batch = cls()
+        batch.extend(wines)
+        return batch
+
+    def __len__(self):
+        return len(self.columns['code'])
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self.row(position)
+
+    def fields(self):
+        return list(self.columns)
+
+    def append(self, wine):
+        columns = self.columns
+        for field in self.FLOAT_FIELDS:
+            columns[field].append(_to_float(wine.get(field)))
+        for field in self.INT_FIELDS:
+            columns[field].append(_to_int(wine.get(field)))
+        for field in ('winery', 'winery_id', 'varietal', 'type'):
+            columns[field].append(wine.get(field) or '')
+        levels = split_region(wine.get('region', ''))
+        for field, level in zip(('country', 'region', 'sub_region1',
+                                 'sub_region2'), levels):
+            columns[field].append(level)
+        for field in self.TEXT_FIELDS:
+            columns[field].append(wine.get(field) or '')
+        columns['available'].append(1 if wine.get('available') == 1 else 0)
+
+    def extend(self, wines):
+        for wine in wines:
+            self.append(wine)
+
+    def row(self, position):
+        output = {
+            field: column[position]
+            for (field, column) in self.columns.items()
+        }
+        output['available'] = bool(output['available'])
+        return output
+
+    def take(self, indices):
+        """New batch holding the rows at ``indices``, in that order."""
+        indices = list(indices)
+        numpy = _numpy()
+        if numpy is not None:
+            positions = numpy.array(indices, dtype=numpy.intp)
+        else:
+            positions = indices
+        batch = self.__class__.__new__(self.__class__)
+        batch.columns = {}
+        for field, column in self.columns.items():
+            if isinstance(column, StringColumn):
+                batch.columns[field] = column.take(positions)
+            elif isinstance(column, array):
+                batch.columns[field] = _take_array(column, positions)
+            else:
+                batch.columns[field] = list(_gather(column, indices))
+        return batch
+
+    def indices(self, min_price=None, max_price=None, min_rank=None,
+                max_rank=None, available=None, **equals):
+        """Row positions matching every condition. Range conditions use
+        the wine_search names, keyword ``equals`` match string fields,
+        e.g. ``country='France'``."""
+        conditions = self._conditions(min_price, max_price, min_rank,
+                                      max_rank, available, equals)
+        numpy = _numpy()
+        if numpy is not None:
+            selected = numpy.ones(len(self), dtype=bool)
+            for column, compare, value in conditions:
+                selected &= compare(_view(numpy, column), value)
+            return numpy.flatnonzero(selected).tolist()
+        if not conditions:
+            return list(range(len(self)))
+        matches = None
+        for column, compare, value in conditions:
+            condition = imap(compare, column, repeat(value))
+            matches = condition if matches is None else \
+                imap(and_, matches, condition)
+        return list(compress(count(), matches))
+
+    def filter(self, min_price=None, max_price=None, min_rank=None,
+               max_rank=None, available=None, **equals):
+        return self.take(self.indices(min_price, max_price, min_rank,
+                                      max_rank, available, **equals))
+
+    def sort(self, by, reverse=False):
+        return self.take(self._ordered(by, reverse))
+
+    def top_k(self, by, k, smallest=False):
+        """The ``k`` rows with the largest (or smallest) ``by`` values,
+        best first. NaN never ranks ahead of a number."""
+        if _numpy() is not None and isinstance(self.columns[by], array):
+            return self.take(self._ordered(by, not smallest)[:k])
+        key = self._sort_key(by, smallest)
+        if smallest:
+            positions = heapq.nsmallest(k, range(len(self)), key=key)
+        else:
+            positions = heapq.nlargest(k, range(len(self)), key=key)
+        return self.take(positions)
+
+    def _conditions(self, min_price, max_price, min_rank, max_rank,
+                    available, equals):
+        """``(column, compare, value)`` triples over typed arrays, a row
+        matches when ``compare(column[row], value)`` holds for all."""
+        price = self.columns['price']
+        rank = self.columns['snoothrank']
+        conditions = [
+            (column, compare, value) for (column, compare, value) in (
+                (price, ge, min_price), (price, le, max_price),
+                (rank, ge, min_rank), (rank, le, max_rank)
+            ) if value is not None
+        ]
+        if available is not None:
+            conditions.append((self.columns['available'], eq,
+                               1 if available else 0))
+        for field, value in equals.items():
+            column = self.columns[field]
+            conditions.append((column.codes, eq, column.code(value)))
+        return conditions
+
+    def _ordered(self, by, reverse):
+        column = self.columns[by]
+        numpy = _numpy()
+        if numpy is not None and isinstance(column, array):
+            # A stable argsort keeps ties in row order like sorted does
+            # and puts NaN last either way.
+            values = _view(numpy, column)
+            order = numpy.argsort(-values if reverse else values,
+                                  kind='stable')
+            return order.tolist()
+        return sorted(range(len(self)), key=self._sort_key(by, not reverse),
+                      reverse=reverse)
+
+    def _sort_key(self, by, ascending):
+        column = self.columns[by]
+        missing = float('inf') if ascending else float('-inf')
+        if isinstance(column, array) and column.typecode == 'd':
+            return lambda i: column[i] if column[i] == column[i] else missing
+        return column.__getitem__
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for SnoothClient against a local FakeSnoothServer.
+
+    python snoothclient/bench.py --output results.json
+    python snoothclient/bench.py --compare results.json
+
+Each scenario reports throughput, p50/p99 latency and peak traced memory.
+Results are saved as JSON; --compare prints the change against a previous
+run so regressions between versions show up.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+from batch import WineBatch
+from cassette import Cassette
+from client import SnoothClient
+from fakeserver import FakeSnoothServer
+from retry import RetryPolicy
+
+FILTER = {'min_price': 20, 'max_price': 60, 'min_rank': 3}
+
+
+def percentile(samples, percent):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    return samples[int(round(percent / 100.0 * (len(samples) - 1)))]
+
+
+def measure(operation, iterations, units=1):
+    """Run ``operation`` ``iterations`` times. ``units`` is how many items
+    one run handles, used for the throughput figure. Runs that raise, as
+    injected errors make them, are timed and counted in ``errors``. Peak
+    memory comes from one extra traced run so tracing does not skew the
+    timings."""
+    latencies = []
+    errors = 0
+    started = clock()
+    for _ in range(iterations):
+        began = clock()
+        try:
+            operation()
+        except Exception:
+            errors += 1
+        latencies.append(clock() - began)
+    elapsed = clock() - started
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            operation()
+        except Exception:
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'seconds': elapsed,
+        'throughput': iterations * units / elapsed if elapsed else None,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'peak_memory': peak
+    }
+
+
+def filter_dicts(wines, min_price, max_price, min_rank):
+    """What WineBatch.filter replaces: a loop parsing the raw dicts."""
+    selected = []
+    for wine in wines:
+        try:
+            price = float(wine['price'])
+            rank = float(wine['snoothrank'])
+        except (TypeError, ValueError):
+            continue
+        if min_price <= price <= max_price and rank >= min_rank:
+            selected.append(wine)
+    return selected
+
+
+def scenarios(snooth, server, options):
+    count = options.count
+    page = snooth.wine_search(count=count)
+    stores = snooth.store_search()
+    wine_ids = ['wine-%d' % index for index in range(1, options.batch + 1)]
+    replay = server.point(SnoothClient(api_key='bench', cassette=Cassette()))
+    replay.wine_search(count=count)
+    replay.wine_detail('wine-7')
+    rows = [server.wine(index) for index in range(1, options.rows + 1)]
+    batch = WineBatch.from_wines(rows)
+    return [
+        ('wine_search', lambda: snooth.wine_search(count=count), count),
+        ('wine_search_stream',
+         lambda: list(snooth.wine_search(count=count, stream=True)), count),
+        ('wine_search_batch',
+         lambda: snooth.wine_search(count=count, batch=True), count),
+        ('wine_detail', lambda: snooth.wine_detail('wine-7'), 1),
+        ('wine_search_replay', lambda: replay.wine_search(count=count),
+         count),
+        ('wine_detail_replay', lambda: replay.wine_detail('wine-7'), 1),
+        ('wine_details', lambda: snooth.wine_details(wine_ids),
+         len(wine_ids)),
+        ('iter_wine_search',
+         lambda: list(snooth.iter_wine_search(count=count)),
+         server.catalog_size),
+        ('iter_wine_search_prefetch',
+         lambda: list(snooth.iter_wine_search(count=count, prefetch=True)),
+         server.catalog_size),
+        ('store_search', lambda: snooth.store_search(), len(stores)),
+        ('wineify', lambda: snooth.wineify(page), len(page)),
+        ('wineify_lazy', lambda: snooth.wineify(page, lazy=True),
+         len(page)),
+        ('storeify', lambda: snooth.storeify(stores), len(stores)),
+        ('filter_dicts', lambda: filter_dicts(rows, **FILTER), len(rows)),
+        ('wine_batch_filter', lambda: batch.filter(**FILTER), len(rows)),
+        ('wine_batch_top_k', lambda: batch.top_k('snoothrank', 100),
+         len(rows)),
+    ]
+
+
+def run(options):
+    server = FakeSnoothServer(
+        catalog_size=options.catalog_size,
+        store_count=options.stores,
+        padding=options.padding,
+        latency=options.latency,
+        jitter=options.jitter,
+        seed=options.seed
+    )
+    results = {}
+    with server:
+        retry = RetryPolicy(retries=options.retries, backoff=0.01)
+        snooth = SnoothClient(api_key='bench', retry=retry)
+        with server.point(snooth):
+            # Errors are injected into the measured runs only.
+            prepared = scenarios(snooth, server, options)
+            server.error_rate = options.error_rate
+            server.snooth_error_rate = options.snooth_error_rate
+            for name, operation, units in prepared:
+                if options.only and name not in options.only:
+                    continue
+                results[name] = measure(operation, options.iterations,
+                                        units)
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'label': options.label,
+        'python': platform.python_version(),
+        'options': vars(options),
+        'results': results
+    }
+
+
+def compare(current, previous):
+    lines = []
+    for name, result in sorted(current['results'].items()):
+        before = previous['results'].get(name)
+        line = '%-28s %10.1f/s  p50 %8.2fms  p99 %8.2fms  mem %8.1fKB' % (
+            name, result['throughput'], result['p50'] * 1000,
+            result['p99'] * 1000, (result['peak_memory'] or 0) / 1024.0
+        )
+        if result.get('errors'):
+            line += '  errors %d' % result['errors']
+        if before and before['throughput']:
+            change = (result['throughput'] / before['throughput'] - 1) * 100
+            line += '  throughput %+6.1f%%' % change
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--count', type=int, default=100,
+                        help='wines per search page')
+    parser.add_argument('--batch', type=int, default=50,
+                        help='wine ids per wine_details call')
+    parser.add_argument('--catalog-size', type=int, default=500)
+    parser.add_argument('--stores', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='wines in the filter scenarios')
+    parser.add_argument('--padding', type=int, default=0,
+                        help='extra bytes per record')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds the fake API sleeps per request')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='random extra seconds of latency, up to this')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of requests answered with a 503')
+    parser.add_argument('--snooth-error-rate', type=float, default=0,
+                        help='share of requests answered with a Snooth '
+                        'errmsg')
+    parser.add_argument('--retries', type=int, default=0,
+                        help='client retries for failed GETs')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for injected latency and errors')
+    parser.add_argument('--only', nargs='*', help='scenario names to run')
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', help='save results to this JSON file')
+    parser.add_argument('--compare', help='previous results JSON file')
+    options = parser.parse_args(argv)
+    output, previous = options.output, options.compare
+    current = run(options)
+    if previous and os.path.exists(previous):
+        with open(previous) as results_file:
+            previous = json.load(results_file)
+    else:
+        previous = {'results': {}}
+    sys.stdout.write(compare(current, previous) + '\n')
+    if output:
+        with open(output, 'w') as results_file:
+            json.dump(current, results_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+try:
+    from time import monotonic as now
+except ImportError:
+    from time import time as now
+
+CREDENTIAL_PARAMS = ('akey', 'u', 'p')
+WINE_ENDPOINTS = ('wine_detail', 'wine_search')
+
+
+def cache_key(endpoint, params):
+    """Hashable key for a request: the endpoint name and its non empty
+    params, credentials excluded."""
+    items = [
+        (field, value) for (field, value) in params.items()
+        if field not in CREDENTIAL_PARAMS and value is not None
+    ]
+    return endpoint, tuple(sorted(items))
+
+
+def listed_wines(key, value):
+    """Codes of the wines a cached wine_detail or wine_search response
+    holds, rating or listing them makes the response stale."""
+    if key[0] == 'wine_detail':
+        return [dict(key[1]).get('id')]
+    if key[0] == 'wine_search':
+        return [wine.get('code') for wine in value.get('wines') or []]
+    return []
+
+
+class BaseCache(object):
+    """Key building and invalidation shared by the cache backends.
+    Subclasses provide get, set, clear, __len__, invalidate_wine and
+    _drop."""
+
+    def key(self, endpoint, params):
+        return cache_key(endpoint, params)
+
+    def ttl_for(self, endpoint):
+        return self.ttls.get(endpoint, self.ttl)
+
+    def invalidate(self, endpoint=None, **params):
+        """Drop entries for ``endpoint`` (or every endpoint) whose params
+        include all of ``params``. Returns the number of entries dropped."""
+        def matches(key):
+            if endpoint is not None and key[0] != endpoint:
+                return False
+            key_params = dict(key[1])
+            for field, expected in params.items():
+                if key_params.get(field) != expected:
+                    return False
+            return True
+        return self._drop(matches, endpoint)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self),
+            'maxsize': self.maxsize
+        }
+
+
+class ResponseCache(BaseCache):
+    """In memory LRU cache of parsed Snooth responses.
+
+    Entries are keyed on the endpoint name and its query params, minus
+    credentials, and expire after ``ttl`` seconds or the per endpoint value
+    in ``ttls``. Cached responses are shared between callers and must be
+    treated as read only.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, ttls=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= now():
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key, stale=0):
+        """``(value, remaining)`` for ``key``, remaining being the seconds
+        until it expires and negative once it has. None when missing or
+        expired more than ``stale`` seconds ago."""
+        with self._lock:
+            entry = self._entries.get(key)
+            timestamp = now()
+            if entry is None or entry[0] + stale <= timestamp:
+                self.misses += 1
+                return None
+            self._entries.pop(key)
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1], entry[0] - timestamp
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl_for(key[0])
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now() + ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate_wine(self, wine_id):
+        """Drop wine_detail entries for ``wine_id`` and any wine_search page
+        listing it."""
+        with self._lock:
+            stale = [
+                key for (key, (expires, value)) in self._entries.items()
+                if wine_id in listed_wines(key, value)
+            ]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def _drop(self, matches, endpoint=None):
+        with self._lock:
+            stale = [key for key in self._entries if matches(key)]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+
+class SQLiteCache(BaseCache):
+    """Response cache stored in a SQLite file so that several processes,
+    and restarted ones, share cached payloads.
+
+    Expiry uses wall clock time. Least recently used rows are evicted once
+    more than ``maxsize`` rows exist; the check runs every
+    ``prune_interval`` writes so the cap may be briefly exceeded. The
+    ``wines`` column holds the codes from listed_wines, newline delimited,
+    so invalidate_wine never decodes a payload.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS responses ('
+        'key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, '
+        'value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL, '
+        'wines TEXT)',
+        'CREATE INDEX IF NOT EXISTS responses_accessed '
+        'ON responses (accessed)',
+        'CREATE INDEX IF NOT EXISTS responses_endpoint '
+        'ON responses (endpoint)',
+    )
+
+    def __init__(self, path, maxsize=100000, ttl=3600, ttls=None,
+                 prune_interval=100, timeout=30):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.prune_interval = prune_interval
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+        with self._connection() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def __len__(self):
+        cursor = self._connection().execute('SELECT COUNT(*) FROM responses')
+        return cursor.fetchone()[0]
+
+    def get(self, key):
+        serialized = json.dumps(key)
+        timestamp = time.time()
+        with self._connection() as connection:
+            row = connection.execute(
+                'SELECT value FROM responses WHERE key = ? AND expires > ?',
+                (serialized, timestamp)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE responses SET accessed = ? WHERE key = ?',
+                    (timestamp, serialized)
+                )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def peek(self, key, stale=0):
+        """Like ResponseCache.peek. Expired rows only survive until the
+        next prune."""
+        serialized = json.dumps(key)
+        timestamp = time.time()
+        with self._connection() as connection:
+            row = connection.execute(
+                'SELECT value, expires FROM responses '
+                'WHERE key = ? AND expires > ?',
+                (serialized, timestamp - stale)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE responses SET accessed = ? WHERE key = ?',
+                    (timestamp, serialized)
+                )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0]), row[1] - timestamp
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl_for(key[0])
+        timestamp = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(key, endpoint, value, expires, accessed, wines) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (json.dumps(key), key[0], json.dumps(value),
+                 timestamp + ttl, timestamp, self._wines(key, value))
+            )
+        self._writes += 1
+        if self._writes % self.prune_interval == 0:
+            self.prune()
+
+    def prune(self):
+        """Delete expired rows, then the least recently used ones above
+        ``maxsize``."""
+        with self._connection() as connection:
+            connection.execute('DELETE FROM responses WHERE expires <= ?',
+                               (time.time(),))
+            connection.execute(
+                'DELETE FROM responses WHERE key IN ('
+                'SELECT key FROM responses ORDER BY accessed DESC '
+                'LIMIT -1 OFFSET ?)',
+                (self.maxsize,)
+            )
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM responses')
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def invalidate_wine(self, wine_id):
+        """Drop wine_detail entries for ``wine_id`` and any wine_search page
+        listing it."""
+        with self._connection() as connection:
+            cursor = connection.execute(
+                'DELETE FROM responses WHERE endpoint IN (?, ?) '
+                'AND instr(wines, ?) > 0',
+                WINE_ENDPOINTS + ('\n%s\n' % wine_id,)
+            )
+        return cursor.rowcount
+
+    def _drop(self, matches, endpoint=None):
+        query = 'SELECT key FROM responses'
+        args = ()
+        if endpoint is not None:
+            query += ' WHERE endpoint = ?'
+            args = (endpoint,)
+        with self._connection() as connection:
+            stale = []
+            for (serialized,) in connection.execute(query, args).fetchall():
+                endpoint, params = json.loads(serialized)
+                key = endpoint, tuple(tuple(item) for item in params)
+                if matches(key):
+                    stale.append((serialized,))
+            connection.executemany('DELETE FROM responses WHERE key = ?',
+                                   stale)
+        return len(stale)
+
+    def _wines(self, key, value):
+        codes = listed_wines(key, value)
+        if not codes:
+            return None
+        return '\n%s\n' % '\n'.join(str(code) for code in codes)
+
+    def _connection(self):
+        """One connection per thread and per process, sqlite3 connections
+        must not cross either."""
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            self._local.connection = None
+            self._local.pid = pid
+        if self._local.connection is None:
+            import sqlite3
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return self._local.connection
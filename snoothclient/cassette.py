@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import json
+import threading
+from datetime import timedelta
+from cache import cache_key
+from handlers import CassetteMissError
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+MODES = ('auto', 'record', 'replay')
+
+
+class CassetteResponse(object):
+    """Recorded response exposing the parts of requests.Response the
+    client reads. Instances are shared between replays and never change."""
+
+    __slots__ = ('status_code', 'content', 'url')
+
+    elapsed = timedelta(0)
+    headers = {}
+
+    def __init__(self, status_code, content, url=''):
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+
+    def iter_content(self, chunk_size=1):
+        content = self.content
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            from requests import HTTPError
+            raise HTTPError(
+                '%s Error for url: %s' % (self.status_code, self.url),
+                response=self
+            )
+
+    def close(self):
+        pass
+
+
+class Cassette(object):
+    """Recorded Snooth responses kept in memory and saved to ``path``.
+
+    Requests are keyed on the method, the URL path and the params minus
+    credentials, so cassettes recorded against one host replay against
+    any other. In ``auto`` mode recorded requests are replayed and the
+    rest sent and recorded, ``record`` always sends and ``replay`` raises
+    CassetteMissError for anything not on the cassette. 5xx responses are
+    never recorded. Paths ending in .gz are gzip compressed.
+    """
+
+    def __init__(self, path=None, mode='auto'):
+        if mode not in MODES:
+            raise ValueError('mode must be one of %s' % ', '.join(MODES))
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._responses = {}
+        self._lock = threading.Lock()
+        if path is not None and mode != 'record':
+            try:
+                self.load(path)
+            except IOError:
+                if mode == 'replay':
+                    raise
+
+    def __len__(self):
+        return len(self._responses)
+
+    def key(self, method, url, params):
+        return cache_key('%s %s' % (method, urlparse(url).path), params)
+
+    def get(self, key):
+        response = self._responses.get(key)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def set(self, key, status_code, content):
+        with self._lock:
+            self._responses[key] = CassetteResponse(status_code, content,
+                                                    key[0])
+            self.dirty = True
+
+    def session(self, session_factory):
+        return CassetteSession(self, session_factory)
+
+    def load(self, path):
+        with self._open(path, 'rb') as cassette_file:
+            for line in cassette_file:
+                entry = json.loads(line.decode('utf-8'))
+                key = entry['key'], tuple(
+                    tuple(item) for item in entry['params']
+                )
+                self._responses[key] = CassetteResponse(
+                    entry['status'], entry['body'].encode('utf-8'), key[0]
+                )
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            responses = list(self._responses.items())
+            self.dirty = False
+        with self._open(path, 'wb') as cassette_file:
+            for (endpoint, params), response in responses:
+                entry = {
+                    'key': endpoint,
+                    'params': params,
+                    'status': response.status_code,
+                    'body': response.content.decode('utf-8')
+                }
+                cassette_file.write(
+                    (json.dumps(entry, sort_keys=True) + '\n').encode('utf-8')
+                )
+
+    def _open(self, path, mode):
+        if path.endswith('.gz'):
+            return gzip.open(path, mode)
+        return io.open(path, mode)
+
+
+class CassetteSession(object):
+    """Stands in for the client's requests.Session, answering from the
+    cassette and building the real session only to record."""
+
+    def __init__(self, cassette, session_factory):
+        self.cassette = cassette
+        self.session_factory = session_factory
+        self._session = None
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params, **kwargs)
+
+    def post(self, url, params=None, **kwargs):
+        return self.request('POST', url, params, **kwargs)
+
+    def put(self, url, params=None, **kwargs):
+        return self.request('PUT', url, params, **kwargs)
+
+    def request(self, method, url, params, **kwargs):
+        cassette = self.cassette
+        key = cassette.key(method, url, params or {})
+        if cassette.mode != 'record':
+            response = cassette.get(key)
+            if response is not None:
+                return response
+            if cassette.mode == 'replay':
+                raise CassetteMissError(
+                    'No recorded response for %s %s' % key
+                )
+        if self._session is None:
+            self._session = self.session_factory()
+        response = self._session.request(method, url, params=params,
+                                         **kwargs)
+        if response.status_code < 500:
+            cassette.set(key, response.status_code, response.content)
+        return response
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self.cassette.dirty and self.cassette.path is not None:
+            self.cassette.save()
@@ -1,15 +1,45 @@
 # -*- coding: utf-8 -*-
+import copy
 import os
-import sys
-import requests
+import threading
+from batch import WineBatch
+from cache import cache_key
+from coalesce import SingleFlight
+from decoders import JSONDecoder
 from handlers import SnoothError, http_error_handler, snooth_error_handler
-try:
-    API_KEY = os.environ['API_KEY']
-except KeyError:
-    API_KEY = None
-    sys.stderr.write('Please set os.environ["API_KEY"] = yourapikey, '
-                     'or pass api_key param in SnoothClient')
-    from api_key import API_KEY
+from metrics import current_event, instrumented, now, observe
+from regions import split_region
+from retry import retry_handler
+from streaming import RecordParser
+
+RATE_METHOD_ERROR = ('Please use method="POST" to create a new review or '
+                     'method="PUT" to update a review.')
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def resolve_api_key():
+    """API key from the API_KEY environment variable, else from an
+    importable ``api_key`` module, else None."""
+    api_key = os.environ.get('API_KEY')
+    if api_key:
+        return api_key
+    try:
+        from api_key import API_KEY
+    except ImportError:
+        return None
+    return API_KEY
+
+
+def default_client():
+    """SnoothClient shared by model objects that were not built by a
+    client, created on first use."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = SnoothClient()
+        return _default_client
 
 
 class SnoothClient(object):
@@ -24,15 +54,88 @@ class SnoothClient(object):
     STORE_DETAIL_URL = 'https://api.snooth.com/store'
     CREATE_ACCOUNT_URL = 'https://api.snooth.com/create-account/'
     USER_ACTIVITY_URL = 'https://api.snooth.com/action/'
+    STREAM_CHUNK_SIZE = 16384
 
-    def __init__(self, api_key=API_KEY, format='json', ip=None,
-                 username=None, password=None, timeout=None):
-        self.api_key = API_KEY
+    def __init__(self, api_key=None, format='json', ip=None,
+                 username=None, password=None, timeout=None,
+                 pool_connections=10, pool_maxsize=10, pool_block=False,
+                 keep_alive=True, cache=None, coalesce=False,
+                 limiter=None, retry=None, breaker=None, lazy_wines=False,
+                 decoder=None, observers=None, cassette=None,
+                 revalidator=None):
+        self.api_key = api_key or resolve_api_key()
         self.format = format
         self.ip = ip
         self.username = username
         self.password = password
         self.timeout = timeout
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.cache = cache
+        self.inflight = SingleFlight() if coalesce else None
+        self.limiter = limiter
+        self.retry = retry
+        self.breaker = breaker
+        self.lazy_wines = lazy_wines
+        self.decoder = decoder or JSONDecoder()
+        self.observers = list(observers or [])
+        self.cassette = cassette
+        self.revalidator = revalidator
+        self._owner = None
+        self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def as_user(self, username, password=None):
+        """SnoothClient acting for another end user. It shares this
+        client's connection pool, cache, limiter, retry policy, breaker and
+        observers, so one client can serve many users concurrently."""
+        user = copy.copy(self)
+        user.username = username
+        user.password = password
+        user._owner = self._owner or self
+        user._session = None
+        return user
+
+    @property
+    def session(self):
+        """Client owned requests.Session, created on first use so that
+        every endpoint shares one connection pool. User contexts use
+        their owner's."""
+        if self._owner is not None:
+            return self._owner.session
+        if self._session is None:
+            self._session = self._build_session()
+        return self._session
+
+    def close(self):
+        """Release pooled connections and save any new cassette
+        recordings. The client may be used again, a fresh pool is built on
+        the next request."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _build_session(self):
+        if self.cassette is not None:
+            return self.cassette.session(self._http_session)
+        return self._http_session()
+
+    def _http_session(self):
+        from transport import http_session
+        return http_session(self.pool_connections, self.pool_maxsize,
+                            self.pool_block, self.keep_alive)
+
+    def transient_errors(self):
+        """Connection errors and timeouts worth retrying."""
+        from transport import TRANSIENT_ERRORS
+        return TRANSIENT_ERRORS
 
     def basic_params(self):
         params = {
@@ -44,17 +147,437 @@ class SnoothClient(object):
         }
         return params
 
+    @instrumented('wine_search')
     def wine_search(self, q='wine', wineify=False, meta=False, count=10,
                     page=1, first_result=None, available=False,
                     prod_type=None, color=None, store_id=None, country=None,
                     zipcode=None, lat=None, lng=None, sort=None,
                     min_price=None, max_price=None, min_rank=None,
-                    max_rank=None, lang=None, timeout=None):
+                    max_rank=None, lang=None, timeout=None, batch=False,
+                    stream=False):
+        params = self._wine_search_params(
+            q, count, page, first_result, available, prod_type, color,
+            store_id, country, zipcode, lat, lng, sort, min_price,
+            max_price, min_rank, max_rank, lang
+        )
+        timeout = self._get_timeout(timeout)
+        if stream is True:
+            wines = self._stream(self.WINE_SEARCH_URL, params, timeout,
+                                 'wines')
+            return self._wine_stream_output(wines, wineify, batch)
+        python_response = self._read(
+            'wine_search', self.WINE_SEARCH_URL, params, timeout
+        )
+        return self._wine_search_output(python_response, wineify, meta,
+                                        batch)
+
+    def iter_wine_search(self, q='wine', wineify=False, count=10, page=1,
+                         first_result=None, available=False,
+                         prod_type=None, color=None, store_id=None,
+                         country=None, zipcode=None, lat=None, lng=None,
+                         sort=None, min_price=None, max_price=None,
+                         min_rank=None, max_rank=None, lang=None,
+                         prefetch=False, timeout=None):
+        """Yield every wine matching the search, fetching ``count`` wines
+        per request until meta['results'] is exhausted. With
+        ``prefetch=True`` the next page is requested in the background
+        while the current one is consumed."""
+        timeout = self._get_timeout(timeout)
+
+        def fetch_page(first_result):
+            params = self._wine_search_params(
+                q, count, page, first_result, available, prod_type, color,
+                store_id, country, zipcode, lat, lng, sort, min_price,
+                max_price, min_rank, max_rank, lang
+            )
+            return self._observed(
+                'wine_search', self._read, 'wine_search',
+                self.WINE_SEARCH_URL, params, timeout
+            )
+
+        first_result = self._paginator(count, page, first_result)
+        pages = self._iter_pages(fetch_page, 'wines', count, first_result,
+                                 prefetch)
+        for wines in pages:
+            if wineify is True:
+                wines = self.wineify(wines)
+            for wine in wines:
+                yield wine
+
+    @instrumented('wine_detail')
+    def wine_detail(self, wine_id, price=False, country=None, zipcode=None,
+                    pairings=False, photos=False, lat=None, lng=None,
+                    language=None, timeout=None):
+        params = self._wine_detail_params(
+            wine_id, price, country, zipcode, pairings, photos, lat, lng,
+            language
+        )
+        timeout = self._get_timeout(timeout)
+        python_response = self._read(
+            'wine_detail', self.WINE_DETAIL_URL, params, timeout
+        )
+        return self._wine_detail_output(python_response)
+
+    def wine_details(self, wine_ids, workers=None, **kwargs):
+        """Fetch several wines concurrently with wine_detail.
+
+        Returns ``(wines, errors)``: ``wines`` follows the order of
+        ``wine_ids`` with None for failed lookups and ``errors`` maps each
+        failed id to its exception. Extra keyword arguments are passed to
+        wine_detail.
+        """
+        workers = self._get_workers(workers)
+        results = self._map_wine_details(list(wine_ids), workers, kwargs,
+                                         ordered=True)
+        return self._collect_details(results)
+
+    def iter_wine_details(self, wine_ids, workers=None, **kwargs):
+        """Like wine_details but yields ``(wine_id, wine, error)`` tuples
+        in completion order as soon as each lookup finishes."""
+        workers = self._get_workers(workers)
+        return self._map_wine_details(list(wine_ids), workers, kwargs,
+                                      ordered=False)
+
+    def _map_wine_details(self, wine_ids, workers, kwargs, ordered):
+        if not wine_ids:
+            return
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(wine_ids)))
+
+        def fetch(wine_id):
+            try:
+                return wine_id, self.wine_detail(wine_id, **kwargs), None
+            except Exception as error:
+                return wine_id, None, error
+
+        try:
+            if ordered:
+                results = pool.imap(fetch, wine_ids)
+            else:
+                results = pool.imap_unordered(fetch, wine_ids)
+            for result in results:
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @instrumented('my_wines')
+    def my_wines(self, wineify=False, username=None, password=None, count=10,
+                 page=1, ratings=True, wishlist=True, cellar=True,
+                 timeout=None, batch=False, stream=False):
+        params = self._my_wines_params(
+            username, password, count, page, ratings, wishlist, cellar
+        )
+        timeout = self._get_timeout(timeout)
+        if stream is True:
+            wines = self._stream(self.MY_WINES_URL, params, timeout, 'wines')
+            return self._wine_stream_output(wines, wineify, batch)
+        response = self.get(self.MY_WINES_URL, params, timeout)
+        python_response = self.parse_get_response(response)
+        return self._my_wines_output(python_response, wineify, batch)
+
+    @instrumented('winery_detail')
+    def winery_detail(self, winery_id, wineryify=False, timeout=None):
+        params = self._winery_detail_params(winery_id)
+        timeout = self._get_timeout(timeout)
+        python_response = self._read(
+            'winery_detail', self.WINERY_DETAIL_URL, params, timeout
+        )
+        return self._winery_detail_output(python_response, wineryify)
+
+    @instrumented('rate_wine')
+    def rate_wine(self, wine_id, method='POST', username=None, password=None,
+                  rating=None, review=None, private=False, tags=None,
+                  wishlist=False, cellar_count=None, timeout=None):
+        params = self._rate_wine_params(
+            wine_id, username, password, rating, review, private, tags,
+            wishlist, cellar_count
+        )
+        timeout = self._get_timeout(timeout)
+        if method == 'POST':
+            response = self.post(self.RATE_WINE_URL, params, timeout)
+        elif method == 'PUT':
+            response = self.put(self.RATE_WINE_URL, params, timeout)
+        else:
+            raise SnoothError(RATE_METHOD_ERROR)
+        python_response = self.parse_post_response(response)
+        self._invalidate_wine(wine_id)
+        return python_response
+
+    @instrumented('wishlist')
+    def wishlist(self, wine_id, username=None, password=None, timeout=None):
+        """Currently just adds to wine list"""
+        params = self._wishlist_params(wine_id, username, password)
+        timeout = self._get_timeout(timeout)
+        response = self.post(self.WISHLIST_WINE_URL, params, timeout)
+        python_response = self.parse_post_response(response)
+        self._invalidate_wine(wine_id)
+        return python_response
+
+    @instrumented('store_search')
+    def store_search(self, country=None, zipcode=None, storeify=False,
+                     meta=False, lat=None, lng=None, timeout=None,
+                     stream=False):
+        params = self._store_search_params(country, zipcode, lat, lng)
+        timeout = self._get_timeout(timeout)
+        if stream is True:
+            stores = self._stream(self.STORE_SEARCH_URL, params, timeout,
+                                  'stores')
+            if storeify is True:
+                stores = (WineStore(store, self) for store in stores)
+            return stores
+        python_response = self._read(
+            'store_search', self.STORE_SEARCH_URL, params, timeout
+        )
+        return self._store_search_output(python_response, storeify, meta)
+
+    @instrumented('store_detail')
+    def store_detail(self, store_id, reviews=True, timeout=None):
+        params = self._store_detail_params(store_id, reviews)
+        timeout = self._get_timeout(timeout)
+        python_response = self._read(
+            'store_detail', self.STORE_DETAIL_URL, params, timeout
+        )
+        return self._detail_output(python_response, 'store')
+
+    @instrumented('create_account')
+    def create_account(self, email=None, screen_name=None,
+                       password=None, timeout=None):
+        params = self._create_account_params(email, screen_name, password)
+        timeout = self._get_timeout(timeout)
+        response = self.post(self.CREATE_ACCOUNT_URL, params, timeout)
+        python_response = self.parse_post_response(response)
+        return python_response
+
+    @instrumented('user_activity')
+    def user_activity(self, activity_type=None, before_date='now', count=50,
+                      page=1, first_result=1, timeout=None, stream=False):
+        params = self._user_activity_params(
+            before_date, count, page, first_result
+        )
+        timeout = self._get_timeout(timeout)
+        if stream is True:
+            return self._stream(self.USER_ACTIVITY_URL, params, timeout,
+                                'actions')
+        response = self.get(self.USER_ACTIVITY_URL, params, timeout)
+        python_response = self.parse_get_response(response)
+        return self._detail_output(python_response, 'actions')
+
+    def iter_user_activity(self, before_date='now', count=50, page=1,
+                           first_result=None, prefetch=False, timeout=None):
+        """Yield user actions page by page, see iter_wine_search."""
+        timeout = self._get_timeout(timeout)
+
+        def fetch_page(first_result):
+            params = self._user_activity_params(
+                before_date, count, page, first_result
+            )
+            return self._observed('user_activity', self._get_parsed,
+                                  self.USER_ACTIVITY_URL, params, timeout)
+
+        first_result = self._paginator(count, page, first_result)
+        pages = self._iter_pages(fetch_page, 'actions', count, first_result,
+                                 prefetch)
+        for actions in pages:
+            for action in actions:
+                yield action
+
+    def wineify(self, input, username=None, password=None, lazy=None,
+                processes=None, chunk_size=20000, index=None):
+        """Wine objects for the raw wine dicts in ``input``. With
+        ``processes`` the dicts are converted in shards of ``chunk_size``
+        across that many worker processes and come back as a PackedRecords
+        sequence, whose Wines are built as they are read. With a
+        RegionIndex ``index`` every Wine is filed in it and its
+        ``region_id`` set to its node."""
+        if processes is not None:
+            from parallel import pack
+            username, password = self._get_credentials(username, password)
+            constants = {'username': username, 'password': password}
+            if index is None:
+                constants['_region_id'] = None
+            wines = pack(Wine, input, processes, chunk_size, constants, self)
+            if index is not None:
+                region_ids = []
+                for wine in wines:
+                    wine.region_id = index.add(wine)
+                    region_ids.append(wine.region_id)
+                wines.add_column('_region_id', region_ids)
+            return wines
+        wines = list(self._iter_wineify(input, username, password, lazy))
+        if index is not None:
+            for wine in wines:
+                wine.region_id = index.add(wine)
+        return wines
+
+    def _iter_wineify(self, input, username=None, password=None,
+                      lazy=None):
+        username, password = self._get_credentials(username, password)
+        if lazy is None:
+            lazy = self.lazy_wines
+        wine_class = LazyWine if lazy else Wine
+        for wine in input:
+            yield wine_class(wine, username=username, password=password,
+                             client=self)
+
+    def storeify(self, input, processes=None, chunk_size=20000):
+        """WineStore objects for the raw store dicts in ``input``,
+        converted across ``processes`` worker processes as in wineify."""
+        if processes is not None:
+            from parallel import pack
+            return pack(WineStore, input, processes, chunk_size, client=self)
+        stores = [WineStore(store, self) for store in input]
+        return stores
+
+    @retry_handler(idempotent=True)
+    @http_error_handler
+    def get(self, url, params, timeout, stream=False):
+        self._throttle()
+        response = self.session.get(
+            url,
+            params=params,
+            verify=True,
+            timeout=timeout,
+            stream=stream
+        )
+        self._record_response(response, stream)
+        return response
+
+    @retry_handler()
+    @http_error_handler
+    def post(self, url, params, timeout):
+        self._throttle()
+        response = self.session.post(
+            url,
+            params=params,
+            verify=True,
+            timeout=timeout
+        )
+        self._record_response(response)
+        return response
+
+    @retry_handler()
+    @http_error_handler
+    def put(self, url, params, timeout):
+        self._throttle()
+        response = self.session.put(
+            url,
+            params=params,
+            verify=True,
+            timeout=timeout
+        )
+        self._record_response(response)
+        return response
+
+    def _read(self, endpoint, url, params, timeout):
+        """GET and parse a read only endpoint, going through the response
+        cache and collapsing identical in flight requests when those are
+        enabled."""
+        key = cache_key(endpoint, params)
+        if self.cache is not None:
+            python_response = self._cached(endpoint, key, url, params,
+                                           timeout)
+            if python_response is not None:
+                event = current_event()
+                if event is not None:
+                    event.cache_hit = True
+                return python_response
+        if self.inflight is not None:
+            return self.inflight.do(key, self._fetch, key, url, params,
+                                    timeout)
+        return self._fetch(key, url, params, timeout)
+
+    def _cached(self, endpoint, key, url, params, timeout):
+        """Cached response for ``key`` or None. Endpoints covered by the
+        revalidator may be served stale while they refresh in the
+        background."""
+        revalidator = self.revalidator
+        if revalidator is None or endpoint not in revalidator.endpoints:
+            return self.cache.get(key)
+        entry = self.cache.peek(key, revalidator.stale)
+        hits = revalidator.touch(key)
+        if entry is None:
+            return None
+        python_response, remaining = entry
+        if revalidator.due(remaining, hits):
+            revalidator.refresh(key, self._fetch, key, url, params, timeout)
+        return python_response
+
+    def _fetch(self, key, url, params, timeout):
+        response = self.get(url, params, timeout)
+        python_response = self.parse_get_response(response)
+        if self.cache is not None:
+            self.cache.set(key, python_response)
+        return python_response
+
+    def _get_parsed(self, url, params, timeout):
+        response = self.get(url, params, timeout)
+        return self.parse_get_response(response)
+
+    def _observed(self, endpoint, fn, *args):
+        """``fn(*args)`` reported to the observers as one ``endpoint``
+        call, for requests made outside the instrumented endpoints."""
+        if not self.observers:
+            return fn(*args)
+        return observe(self.observers, endpoint, fn, *args)
+
+    def _stream(self, url, params, timeout, key):
+        """Send the GET now and return a generator parsing the body as it
+        arrives. Streams bypass the cache and request coalescing."""
+        response = self.get(url, params, timeout, stream=True)
+        return self.parse_stream_response(response, key)
+
+    def _record_response(self, response, stream=False):
+        event = current_event()
+        if event is not None:
+            event.ttfb = response.elapsed.total_seconds()
+            if not stream:
+                event.bytes += len(response.content)
+
+    def _throttle(self):
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+    def _invalidate_wine(self, wine_id):
+        if self.cache is not None:
+            self.cache.invalidate_wine(wine_id)
+
+    @snooth_error_handler(post='')
+    def parse_get_response(self, response):
+        return self.decoder.decode(response.content)
+
+    @snooth_error_handler(post='POST')
+    def parse_post_response(self, response):
+        return self.decoder.decode(response.content)
+
+    def parse_stream_response(self, response, key):
+        """Yield the ``key`` records of a streamed response as they are
+        read off the wire, after its meta block has been checked."""
+        parser = RecordParser(key)
+        event = current_event()
+        try:
+            chunks = response.iter_content(chunk_size=self.STREAM_CHUNK_SIZE)
+            for chunk in chunks:
+                started = now()
+                records = parser.feed(chunk)
+                if event is not None:
+                    event.bytes += len(chunk)
+                    event.decode += now() - started
+                for record in records:
+                    yield record
+            for record in parser.close():
+                yield record
+        finally:
+            response.close()
+
+    def _wine_search_params(self, q, count, page, first_result, available,
+                            prod_type, color, store_id, country, zipcode,
+                            lat, lng, sort, min_price, max_price, min_rank,
+                            max_rank, lang):
         self._check_lat_lng(lat, lng)
         params = self.basic_params()
         bools = self._translate_bool(available)
         first_result = self._paginator(count, page, first_result)
-        timeout = self._get_timeout(timeout)
         new_params = {
             'q': q, 'f': first_result, 'n': count, 'a': bools[0],
             't': prod_type, 'color': color, 'm': store_id,
@@ -63,22 +586,13 @@ class SnoothClient(object):
             'mr': min_rank, 'xr': max_rank, 'lang': lang
         }
         params.update(new_params)
-        response = self.get(self.WINE_SEARCH_URL, params, timeout=timeout)
-        python_response = self.parse_get_response(response)
-        output = self._wine_output(python_response)
-        if output and wineify is True:
-            output = self.wineify(output)
-        elif meta is True:
-            output = python_response
-        return output
+        return params
 
-    def wine_detail(self, wine_id, price=False, country=None, zipcode=None,
-                    pairings=False, photos=False, lat=None, lng=None,
-                    language=None, timeout=None):
+    def _wine_detail_params(self, wine_id, price, country, zipcode,
+                            pairings, photos, lat, lng, language):
         self._check_lat_lng(lat, lng)
         params = self.basic_params()
         bools = self._translate_bool(price, pairings, photos)
-        timeout = self._get_timeout(timeout)
         new_params = {
             'id': wine_id,
             'i': bools[0],
@@ -91,21 +605,13 @@ class SnoothClient(object):
             'lang': language
         }
         params.update(new_params)
-        response = self.get(self.WINE_DETAIL_URL, params, timeout)
-        python_response = self.parse_get_response(response)
-        try:
-            output = python_response['wines'][0]
-        except KeyError:
-            raise SnoothError('Unknown error has occured.')
-        return output
+        return params
 
-    def my_wines(self, wineify=False, username=None, password=None, count=10,
-                 page=1, ratings=True, wishlist=True, cellar=True,
-                 timeout=None):
+    def _my_wines_params(self, username, password, count, page, ratings,
+                         wishlist, cellar):
         params = self.basic_params()
         username, password = self._get_credentials(username, password)
         bools = self._translate_bool(ratings, wishlist, cellar)
-        timeout = self._get_timeout(timeout)
         new_params = {
             'u': username,
             'p': password,
@@ -116,35 +622,19 @@ class SnoothClient(object):
             'c': bools[2]
         }
         params.update(new_params)
-        response = self.get(self.MY_WINES_URL, params, timeout)
-        python_response = self.parse_get_response(response)
-        output = self._wine_output(python_response)
-        if wineify is True:
-            output = self.wineify(output)
-        return output
+        return params
 
-    def winery_detail(self, winery_id, wineryify=False, timeout=None):
+    def _winery_detail_params(self, winery_id):
         params = self.basic_params()
-        timeout = self._get_timeout(timeout)
         new_params = {'id': winery_id}
         params.update(new_params)
-        response = self.get(self.WINERY_DETAIL_URL, params, timeout)
-        python_response = self.parse_get_response(response)
-        try:
-            output = python_response['winery']
-        except KeyError:
-            raise SnoothError('Unknown error has occured.')
-        if wineryify is True:
-            output = Winery(output)
-        return output
+        return params
 
-    def rate_wine(self, wine_id, method='POST', username=None, password=None,
-                  rating=None, review=None, private=False, tags=None,
-                  wishlist=False, cellar_count=None, timeout=None):
+    def _rate_wine_params(self, wine_id, username, password, rating, review,
+                          private, tags, wishlist, cellar_count):
         params = self.basic_params()
         username, password = self._get_credentials(username, password)
         bools = self._translate_bool(private, wishlist)
-        timeout = self._get_timeout(timeout)
         new_params = {
             'id': wine_id,
             'u': username,
@@ -157,67 +647,34 @@ class SnoothClient(object):
             'c': cellar_count
         }
         params.update(new_params)
-        if method == 'POST':
-            response = self.post(self.RATE_WINE_URL, params, timeout)
-        elif method == 'PUT':
-            response = self.put(self.RATE_WINE_URL, params, timeout)
-        else:
-            raise SnoothError('Please use method="POST" to create a new '
-                              'review or method="PUT" to update a review.')
-        python_response = self.parse_post_response(response)
-        return python_response
+        return params
 
-    def wishlist(self, wine_id, username=None, password=None, timeout=None):
-        """Currently just adds to wine list"""
+    def _wishlist_params(self, wine_id, username, password):
         params = self.basic_params()
         username, password = self._get_credentials(username, password)
-        timeout = self._get_timeout(timeout)
         new_params = {
             'id': wine_id,
             'u': username,
             'p': password
         }
         params.update(new_params)
-        response = self.post(self.WISHLIST_WINE_URL, params, timeout)
-        python_response = self.parse_post_response(response)
-        return python_response
+        return params
 
-    def store_search(self, country=None, zipcode=None, storeify=False,
-                     meta=False, lat=None, lng=None, timeout=None):
+    def _store_search_params(self, country, zipcode, lat, lng):
         self._check_lat_lng(lat, lng)
         params = self.basic_params()
-        timeout = self._get_timeout(timeout)
         new_params = {'c': country, 'z': zipcode, 'lat': lat, 'lng': lng}
         params.update(new_params)
-        response = self.get(self.STORE_SEARCH_URL, params, timeout)
-        python_response = self.parse_get_response(response)
-        if 'stores' in python_response:
-            output = python_response['stores']
-            if storeify is True:
-                output = self.storeify(output)
-            elif meta is True:
-                output = python_response
-        else:
-            output = None
-        return output
+        return params
 
-    def store_detail(self, store_id, reviews=True, timeout=None):
+    def _store_detail_params(self, store_id, reviews):
         params = self.basic_params()
         bools = self._translate_bool(reviews)
-        timeout = self._get_timeout(timeout)
         new_params = {'id': store_id, 'reviews': bools[0]}
         params.update(new_params)
-        response = self.get(self.STORE_DETAIL_URL, params, timeout)
-        python_response = self.parse_get_response(response)
-        try:
-            output = python_response['store']
-        except KeyError:
-            raise SnoothError('Unknown error has occured.')
-        return output
+        return params
 
-    def create_account(self, email=None, screen_name=None,
-                       password=None, timeout=None):
-        timeout = self._get_timeout(timeout)
+    def _create_account_params(self, email, screen_name, password):
         params = {
             'akey': self.api_key,
             'format': self.format,
@@ -226,14 +683,10 @@ class SnoothClient(object):
             's': screen_name,
             'p': password
         }
-        response = self.post(self.CREATE_ACCOUNT_URL, params, timeout)
-        python_response = self.parse_post_response(response)
-        return python_response
+        return params
 
-    def user_activity(self, activity_type=None, before_date='now', count=50,
-                      page=1, first_result=1, timeout=None):
+    def _user_activity_params(self, before_date, count, page, first_result):
         first_result = self._paginator(count, page, first_result)
-        timeout = self._get_timeout(timeout)
         params = {
             'akey': self.api_key,
             'format': self.format,
@@ -242,66 +695,67 @@ class SnoothClient(object):
             'f': first_result,
             'n': count,
         }
-        response = self.get(self.USER_ACTIVITY_URL, params, timeout)
-        python_response = self.parse_get_response(response)
-        try:
-            output = python_response['actions']
-        except KeyError:
-            raise SnoothClient('Unkown error has occured.')
-        return output
+        return params
 
-    def wineify(self, input, username=None, password=None):
-        username, password = self._get_credentials(username, password)
-        wines = [
-            Wine(wine, username=username,
-                 password=password) for wine in input
-        ]
-        return wines
+    def _wine_output(self, python_response):
+        output = python_response.get('wines', '')
+        return output
 
-    def storeify(self, input):
-        stores = [WineStore(store) for store in input]
-        return stores
+    def _wine_search_output(self, python_response, wineify, meta,
+                            batch=False):
+        output = self._wine_output(python_response)
+        if output and wineify is True:
+            output = self.wineify(output)
+        elif batch is True:
+            output = WineBatch.from_wines(output)
+        elif meta is True:
+            output = python_response
+        return output
 
-    @http_error_handler
-    def get(self, url, params, timeout):
-        response = requests.get(
-            url,
-            params=params,
-            verify=True,
-            timeout=timeout
-        )
-        return response
+    def _wine_stream_output(self, wines, wineify, batch):
+        if wineify is True:
+            wines = self._iter_wineify(wines)
+        elif batch is True:
+            wines = WineBatch.from_wines(wines)
+        return wines
 
-    @http_error_handler
-    def post(self, url, params, timeout):
-        response = requests.post(
-            url,
-            params=params,
-            verify=True,
-            timeout=timeout
-        )
-        return response
+    def _wine_detail_output(self, python_response):
+        try:
+            output = python_response['wines'][0]
+        except KeyError:
+            raise SnoothError('Unknown error has occured.')
+        return output
 
-    @http_error_handler
-    def put(self, url, params, timeout):
-        response = requests.put(
-            url,
-            params=params,
-            verify=True,
-            timeout=timeout
-        )
-        return response
+    def _my_wines_output(self, python_response, wineify, batch=False):
+        output = self._wine_output(python_response)
+        if wineify is True:
+            output = self.wineify(output)
+        elif batch is True:
+            output = WineBatch.from_wines(output)
+        return output
 
-    @snooth_error_handler(post='')
-    def parse_get_response(self, response):
-        return response.json()
+    def _winery_detail_output(self, python_response, wineryify):
+        output = self._detail_output(python_response, 'winery')
+        if wineryify is True:
+            output = Winery(output, self)
+        return output
 
-    @snooth_error_handler(post='POST')
-    def parse_post_response(self, response):
-        return response.json()
+    def _store_search_output(self, python_response, storeify, meta):
+        if 'stores' in python_response:
+            output = python_response['stores']
+            if storeify is True:
+                output = self.storeify(output)
+            elif meta is True:
+                output = python_response
+        else:
+            output = None
+        return output
 
-    def _wine_output(self, python_response):
-        output = python_response.get('wines', '')
+    def _detail_output(self, python_response, key):
+        try:
+            output = python_response[key]
+        except KeyError:
+            raise SnoothError('Unknown error has occured.')
         return output
 
     def _paginator(self, count, page, first_result):
@@ -309,6 +763,46 @@ class SnoothClient(object):
             first_result = ((page - 1) * count) + 1
         return first_result
 
+    def _iter_pages(self, fetch_page, key, count, first_result, prefetch):
+        """Yield the ``key`` list of successive pages. ``fetch_page`` takes
+        the 1-based index of the first result and returns the parsed
+        response."""
+        if prefetch:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(1)
+        else:
+            pool = None
+        try:
+            python_response = fetch_page(first_result)
+            while True:
+                items, next_result, more = self._next_page(
+                    python_response, key, first_result
+                )
+                if more and pool is not None:
+                    pending = pool.apply_async(fetch_page, (next_result,))
+                if items:
+                    yield items
+                if not more:
+                    break
+                if pool is not None:
+                    python_response = pending.get()
+                else:
+                    python_response = fetch_page(next_result)
+                first_result = next_result
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def _next_page(self, python_response, key, first_result):
+        """The ``key`` items of a page, the first result of the next page
+        and whether there is one."""
+        items = python_response.get(key) or []
+        total = python_response['meta'].get('results', 0)
+        next_result = first_result + len(items)
+        more = bool(items) and next_result <= int(total or 0)
+        return items, next_result, more
+
     def _get_credentials(self, username, password):
         if not username:
             username = self.username
@@ -316,6 +810,24 @@ class SnoothClient(object):
             password = self.password
         return username, password
 
+    def _get_workers(self, workers):
+        if workers is None:
+            return self.pool_maxsize
+        if workers < 1:
+            raise SnoothError('workers must be at least 1')
+        return workers
+
+    def _collect_details(self, results):
+        """``(wines, errors)`` from ordered ``(wine_id, wine, error)``
+        results, see wine_details."""
+        wines = []
+        errors = {}
+        for wine_id, wine, error in results:
+            wines.append(wine)
+            if error is not None:
+                errors[wine_id] = error
+        return wines, errors
+
     def _get_timeout(self, timeout):
         if not timeout:
             timeout = self.timeout
@@ -337,29 +849,61 @@ class SnoothClient(object):
 
 
 class SnoothBaseObject(object):
+    """Base for the model classes. Fields live in ``__slots__`` rather than
+    a per instance ``__dict__``; properties, fields and values walk the
+    slots of the whole class hierarchy, base classes first."""
+
+    __slots__ = ('_client',)
+
+    @property
+    def client(self):
+        """SnoothClient this object came from, the shared default client
+        for objects built by hand."""
+        return self._client or default_client()
+
+    @classmethod
+    def _field_names(cls):
+        names = cls.__dict__.get('_slot_names')
+        if names is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                for name in klass.__dict__.get('__slots__', ()):
+                    if name not in names and not name.startswith('_'):
+                        names.append(name)
+            names = tuple(names)
+            cls._slot_names = names
+        return names
 
     def properties(self):
         property_dict = {
-            field: value for (field, value) in vars(self).iteritems()
+            field: getattr(self, field) for field in self.fields()
         }
         return property_dict
 
     def fields(self):
         field_list = [
-            field for field in vars(self).iterkeys()
+            field for field in self._field_names() if hasattr(self, field)
         ]
         return field_list
 
     def values(self):
         value_list = [
-            value for value in vars(self).itervalues()
+            getattr(self, field) for field in self.fields()
         ]
         return value_list
 
 
 class Wine(SnoothBaseObject):
 
-    def __init__(self, wine, username=None, password=None):
+    __slots__ = (
+        'username', 'password', 'name', 'code', 'winery', 'winery_id',
+        'vintage', 'varietal', 'type', 'link', 'image', 'num_merchants',
+        'price', 'num_reviews', 'tags', 'snoothrank', 'country', 'region',
+        'sub_region1', 'sub_region2', 'localities', 'available', '_region_id'
+    )
+
+    def __init__(self, wine, username=None, password=None, client=None):
+        self._client = client
         self.username = username
         self.password = password
         self.name = wine.get('name', '')
@@ -376,57 +920,34 @@ class Wine(SnoothBaseObject):
         self.num_reviews = wine.get('num_reviews', '')
         self.tags = wine.get('tags', '')
         self.snoothrank = wine.get('snoothrank', '')
-        region = wine.get('region', '')
-        locs = region.split(' > ')
-        try:
-            self.country = locs[0]
-            if len(locs) > 4:
-                self.region = locs[1]
-                self.sub_region1 = locs[2]
-                self.sub_region2 = locs[3]
-                self.localities = locs[4:]
-            elif len(locs) > 3:
-                self.region = locs[1]
-                self.sub_region1 = locs[2]
-                self.sub_region2 = locs[3]
-                self.localities = ''
-            elif len(locs) > 2:
-                self.region = locs[1]
-                self.sub_region1 = locs[2]
-                self.sub_region2 = ''
-                self.localities = ''
-            elif len(locs) > 1:
-                self.region = locs[1]
-                self.sub_region1 = ''
-                self.sub_region2 = ''
-                self.localities = ''
-            elif len(locs) == 1:
-                self.region = ''
-                self.sub_region1 = ''
-                self.sub_region2 = ''
-                self.localities = ''
-        except IndexError:
-            self.region = ''
-            self.sub_region1 = ''
-            self.sub_region2 = ''
-            self.localities = ''
+        (self.country, self.region, self.sub_region1, self.sub_region2,
+         self.localities) = split_region(wine.get('region', ''))
         if wine.get('available', '') == 1:
             self.available = True
         else:
             self.available = False
+        self._region_id = None
+
+    @property
+    def region_id(self):
+        """RegionIndex node wineify filed this wine under, None when it
+        was built without an index."""
+        return self._region_id
+
+    @region_id.setter
+    def region_id(self, value):
+        self._region_id = value
 
     def detail(self, price=False, country=None, zipcode=None,
                pairings=False, photos=False, lat=None, lng=None,
                language=None, timeout=None):
-        snooth = SnoothClient()
-        bools = snooth._translate_bool(price, pairings, photos)
-        response = snooth.wine_detail(
+        response = self.client.wine_detail(
             wine_id=self.code,
-            price=bools[0],
+            price=price,
             country=country,
             zipcode=zipcode,
-            pairings=bools[1],
-            photos=bools[2],
+            pairings=pairings,
+            photos=photos,
             lat=lat,
             lng=lng,
             language=language,
@@ -436,40 +957,99 @@ class Wine(SnoothBaseObject):
 
     def rate(self, method='POST', username=None, password=None,
              rating=None, review=None, private=False, tags=None,
-             wishlist=False, cellar_count=None, timeout=None):
-        snooth = SnoothClient()
-        username, password = snooth._get_credentials(username, password)
-        bools = snooth._translate_bool(private, wishlist)
-        response = snooth.wine_rate(
-            username=username,
-            password=password,
+             wishlist=False, cellar_count=None, timeout=None, queue=None):
+        """Rate this wine, or queue the rating on the WriteQueue
+        ``queue`` and return straight away."""
+        if queue is not None:
+            return queue.rate(
+                self.code, method=method,
+                username=username or self.username,
+                password=password or self.password, rating=rating,
+                review=review, private=private, tags=tags,
+                wishlist=wishlist, cellar_count=cellar_count
+            )
+        response = self.client.rate_wine(
+            username=username or self.username,
+            password=password or self.password,
             wine_id=self.code,
             method=method,
             rating=rating,
             review=review,
-            private=bools[0],
+            private=private,
             tags=tags,
-            wishlist=bools[1],
+            wishlist=wishlist,
             cellar_count=cellar_count,
             timeout=timeout
         )
         return response
 
-    def list(self, username=None, password=None, timeout=None):
-        snooth = SnoothClient()
-        username, password = self._get_credentials(username, password)
-        response = snooth.wishlist(
+    def list(self, username=None, password=None, timeout=None, queue=None):
+        """Add this wine to the wishlist, or queue the add on the
+        WriteQueue ``queue``."""
+        if queue is not None:
+            return queue.wishlist(self.code,
+                                  username=username or self.username,
+                                  password=password or self.password)
+        response = self.client.wishlist(
             self.code,
-            username=username,
-            password=password,
+            username=username or self.username,
+            password=password or self.password,
             timeout=timeout
         )
         return response
 
 
+class LazyWine(Wine):
+    """Wine that keeps the raw result dict and decodes each field, the
+    region levels together, the first time it is read."""
+
+    __slots__ = ('_raw',)
+
+    PLAIN_FIELDS = (
+        'name', 'code', 'winery', 'winery_id', 'vintage', 'varietal', 'type',
+        'link', 'image', 'num_merchants', 'price', 'num_reviews', 'tags',
+        'snoothrank'
+    )
+    REGION_FIELDS = (
+        'country', 'region', 'sub_region1', 'sub_region2', 'localities'
+    )
+
+    def __init__(self, wine, username=None, password=None, client=None):
+        self._client = client
+        self._raw = wine
+        self._region_id = None
+        self.username = username
+        self.password = password
+
+    def __getattr__(self, name):
+        # Only called for slots that have not been decoded yet.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        raw = self._raw
+        if name in self.PLAIN_FIELDS:
+            value = raw.get(name, '')
+        elif name in self.REGION_FIELDS:
+            levels = split_region(raw.get('region', ''))
+            for field, level in zip(self.REGION_FIELDS, levels):
+                setattr(self, field, level)
+            return getattr(self, name)
+        elif name == 'available':
+            value = raw.get('available', '') == 1
+        else:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+
+
 class SnoothVendorBase(SnoothBaseObject):
 
-    def __init__(self, vendor):
+    __slots__ = (
+        'name', 'address', 'city', 'state', 'country', 'id', 'email', 'url',
+        'phone', 'num_wines', 'closed'
+    )
+
+    def __init__(self, vendor, client=None):
+        self._client = client
         self.name = vendor.get('name', '')
         self.address = vendor.get('address', '')
         self.city = vendor.get('city', '')
@@ -488,8 +1068,10 @@ class SnoothVendorBase(SnoothBaseObject):
 
 class WineStore(SnoothVendorBase):
 
-    def __init__(self, store):
-        super(WineStore, self).__init__(store)
+    __slots__ = ('lat', 'lng', 'type', 'url_code', 'num_ratings', 'rating')
+
+    def __init__(self, store, client=None):
+        super(WineStore, self).__init__(store, client)
         self.lat = store.get('lat', '')
         self.lng = store.get('lng', '')
         self.type = store.get('type', '')
@@ -498,11 +1080,9 @@ class WineStore(SnoothVendorBase):
         self.rating = store.get('rating', '')
 
     def detail(self, reviews=True, timeout=None):
-        snooth = SnoothClient()
-        bools = snooth._translate_bool(reviews)
-        response = snooth.store_detail(
+        response = self.client.store_detail(
             self.id,
-            reviews=bools[0],
+            reviews=reviews,
             timeout=timeout
         )
         return response
@@ -510,7 +1090,9 @@ class WineStore(SnoothVendorBase):
 
 class Winery(SnoothVendorBase):
 
-    def __init__(self, winery):
-        super(Winery, self).__init__(winery)
+    __slots__ = ('zip', 'image')
+
+    def __init__(self, winery, client=None):
+        super(Winery, self).__init__(winery, client)
         self.zip = winery.get('zip', '')
         self.image = winery.get('image', '')
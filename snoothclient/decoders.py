@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import importlib
+import json
+import sys
+import threading
+from metrics import current_event
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
+BACKENDS = ('orjson', 'ujson', 'json')
+
+
+def _decode_loads(data):
+    """json.loads for Python 3 before 3.6, whose stdlib only takes text."""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+if (3,) <= sys.version_info < (3, 6):
+    json_loads = _decode_loads
+else:
+    json_loads = json.loads
+
+
+class JSONDecoder(object):
+    """Decode response bodies straight from bytes with the fastest JSON
+    library available, and keep count of the time spent doing it.
+
+    ``backend`` names one of BACKENDS, by default the first importable one
+    is used; ``loads`` plugs in any other callable taking bytes.
+    """
+
+    def __init__(self, backend=None, loads=None):
+        if loads is not None:
+            self.backend = getattr(loads, '__module__', None) or 'custom'
+            self.loads = loads
+        else:
+            self.backend, self.loads = self._load_backend(backend)
+        self.decodes = 0
+        self.decode_bytes = 0
+        self.decode_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def decode(self, data):
+        started = clock()
+        output = self.loads(data)
+        elapsed = clock() - started
+        event = current_event()
+        if event is not None:
+            event.decode += elapsed
+        with self._lock:
+            self.decodes += 1
+            self.decode_bytes += len(data)
+            self.decode_seconds += elapsed
+        return output
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'decodes': self.decodes,
+            'bytes': self.decode_bytes,
+            'seconds': self.decode_seconds
+        }
+
+    def _load_backend(self, backend):
+        names = BACKENDS if backend is None else (backend,)
+        for name in names:
+            try:
+                module = importlib.import_module(name)
+            except ImportError:
+                if backend is not None:
+                    raise
+                continue
+            if module is json:
+                return name, json_loads
+            return name, module.loads
+        return 'json', json_loads
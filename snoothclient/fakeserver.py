@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import json
+import random
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+API_URL = 'https://api.snooth.com'
+
+WINERIES = ('Chateau Recougne', 'Catena', 'Yellow Tail', 'Ridge', 'Antinori',
+            'Penfolds', 'Torres', 'Cloudy Bay')
+VARIETALS = ('Red Blend', 'Malbec', 'Shiraz', 'Zinfandel', 'Sangiovese',
+             'Cabernet Sauvignon', 'Tempranillo', 'Sauvignon Blanc')
+REGIONS = (
+    'France > Bordeaux > Bordeaux Superieur',
+    'France > Bordeaux > Medoc > Pauillac',
+    'Argentina > Mendoza',
+    'Australia > South Australia > Barossa > Barossa Valley > Ebenezer',
+    'USA > California > Sonoma County > Dry Creek Valley',
+    'Italy > Tuscany > Chianti > Chianti Classico',
+    'Spain > Catalonia > Penedes',
+    'New Zealand > Marlborough',
+)
+
+
+def _query(path):
+    return dict(
+        (key, values[0]) for (key, values)
+        in parse_qs(urlparse(path).query).items()
+    )
+
+
+class FakeSnoothHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            fail = server.random.random() < server.error_rate
+            snooth_fail = server.random.random() < server.snooth_error_rate
+        delay = server.latency
+        if server.jitter:
+            delay += server.random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return self._send(503, {'error': 'Service Unavailable'})
+        route = urlparse(self.path).path
+        params = _query(self.path)
+        if snooth_fail:
+            payload = {'meta': server.meta(0, errmsg='Injected error')}
+        else:
+            handler = server.routes.get(route)
+            if handler is None:
+                return self._send(404, {'error': 'Not Found'})
+            payload = handler(params)
+        self._send(200, payload)
+
+    do_POST = do_GET
+    do_PUT = do_GET
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeSnoothServer(ThreadingMixIn, HTTPServer):
+    """Local stand in for api.snooth.com serving generated data.
+
+    ``catalog_size`` wines and ``store_count`` stores are generated
+    deterministically from ``seed``; ``padding`` adds that many bytes to
+    every record to grow payloads. ``latency`` (plus up to ``jitter``)
+    seconds are slept per request, ``error_rate`` of requests answer 503
+    and ``snooth_error_rate`` carry a meta errmsg.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, catalog_size=1000, store_count=50, padding=0,
+                 latency=0, jitter=0, error_rate=0, snooth_error_rate=0,
+                 seed=0, port=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeSnoothHandler)
+        self.catalog_size = catalog_size
+        self.store_count = store_count
+        self.padding = padding
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.snooth_error_rate = snooth_error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        self.routes = {
+            '/wines/': self.wine_search,
+            '/wine/': self.wine_detail,
+            '/my-wines/': self.my_wines,
+            '/winery/': self.winery_detail,
+            '/stores/': self.store_search,
+            '/store': self.store_detail,
+            '/action/': self.user_activity,
+            '/rate/': self.write,
+            '/wishlist/': self.write,
+            '/create-account/': self.write,
+        }
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def point(self, client):
+        """Rewrite the client's endpoint URLs to this server."""
+        for attr in dir(client):
+            if attr.endswith('_URL'):
+                path = getattr(client, attr).replace(API_URL, '')
+                setattr(client, attr, self.url + path)
+        return client
+
+    def meta(self, results, returned=None, errmsg='', status=1):
+        return {
+            'results': results,
+            'returned': results if returned is None else returned,
+            'errmsg': errmsg,
+            'status': status
+        }
+
+    def wine(self, index):
+        code = 'wine-%d' % index
+        wine = {
+            'name': 'Wine %d' % index,
+            'code': code,
+            'winery': WINERIES[index % len(WINERIES)],
+            'winery_id': 'winery-%d' % (index % len(WINERIES)),
+            'vintage': str(1990 + index % 30),
+            'varietal': VARIETALS[index % len(VARIETALS)],
+            'type': 'Red Wine' if index % 3 else 'White Wine',
+            'link': 'http://www.snooth.com/wine/%s/' % code,
+            'image': 'http://ei.isnooth.com/%s.jpeg' % code,
+            'region': REGIONS[index % len(REGIONS)],
+            'num_merchants': index % 12,
+            'price': '%.2f' % (5 + index % 200 + 0.99),
+            'num_reviews': index % 57,
+            'tags': '',
+            'snoothrank': round(1 + (index * 7 % 40) / 10.0, 1),
+            'available': index % 4 != 0
+        }
+        if self.padding:
+            wine['description'] = 'x' * self.padding
+        return wine
+
+    def store(self, index):
+        store = {
+            'id': index,
+            'name': 'Store %d' % index,
+            'address': '%d Main Street' % index,
+            'city': 'Iowa City',
+            'state': 'IA',
+            'country': 'us',
+            'zip': '52245',
+            'lat': 41.66 + (index % 100) / 1000.0,
+            'lng': -91.53 - (index % 100) / 1000.0,
+            'type': 'Wine Store',
+            'url_code': 'store-%d' % index,
+            'num_ratings': index % 9,
+            'rating': index % 5,
+            'num_wines': 100 + index
+        }
+        if self.padding:
+            store['description'] = 'x' * self.padding
+        return store
+
+    def _page(self, params, total):
+        first = int(params.get('f', 1))
+        count = int(params.get('n', 10))
+        return range(first, min(first + count, total + 1))
+
+    def wine_search(self, params):
+        indices = self._page(params, self.catalog_size)
+        wines = [self.wine(index) for index in indices]
+        return {'meta': self.meta(self.catalog_size, len(wines)),
+                'wines': wines}
+
+    def wine_detail(self, params):
+        try:
+            index = int(params.get('id', '').rsplit('-', 1)[-1])
+        except ValueError:
+            return {'meta': self.meta(0, errmsg='Wine not found')}
+        return {'meta': self.meta(1), 'wines': [self.wine(index)]}
+
+    def my_wines(self, params):
+        count = int(params.get('n', 10))
+        page = int(params.get('pg', 1))
+        first = (page - 1) * count + 1
+        wines = [self.wine(index) for index in
+                 range(first, min(first + count, self.catalog_size + 1))]
+        return {'meta': self.meta(self.catalog_size, len(wines)),
+                'wines': wines}
+
+    def winery_detail(self, params):
+        winery_id = params.get('id', 'winery-0')
+        index = int(winery_id.rsplit('-', 1)[-1]) \
+            if winery_id.rsplit('-', 1)[-1].isdigit() else 0
+        winery = self.store(index)
+        winery.update({'id': winery_id,
+                       'name': WINERIES[index % len(WINERIES)]})
+        return {'meta': self.meta(1), 'winery': winery}
+
+    def store_search(self, params):
+        stores = [self.store(index) for index in range(self.store_count)]
+        return {'meta': self.meta(len(stores)), 'stores': stores}
+
+    def store_detail(self, params):
+        index = int(params.get('id', 0))
+        return {'meta': self.meta(1), 'store': self.store(index)}
+
+    def user_activity(self, params):
+        indices = self._page(params, self.catalog_size)
+        actions = [
+            {'id': index, 'type': 'rating', 'wine': 'wine-%d' % index,
+             'date': '2013-05-%02d' % (index % 28 + 1)}
+            for index in indices
+        ]
+        return {'meta': self.meta(self.catalog_size, len(actions)),
+                'actions': actions}
+
+    def write(self, params):
+        return {'meta': self.meta(1)}
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+try:
+    from time import monotonic as now
+except ImportError:
+    from time import time as now
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great circle distance in kilometres between two points."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def coordinates(store):
+    """``(lat, lng)`` floats of a raw store dict or a WineStore, None when
+    either is missing."""
+    if isinstance(store, dict):
+        lat, lng = store.get('lat'), store.get('lng')
+    else:
+        lat, lng = store.lat, store.lng
+    try:
+        return float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+
+
+def store_id(store):
+    if isinstance(store, dict):
+        return store.get('id')
+    return store.id
+
+
+class StoreIndex(object):
+    """Grid index over stores pulled from store_search, answering radius
+    and nearest store queries without calling the API.
+
+    Stores are bucketed into ``cell_size`` degree cells. Each
+    ``(country, zipcode)`` area loaded through refresh remembers its stores
+    and load time, so refreshing an area replaces only its stores and
+    refresh_stale reloads areas older than ``max_age`` seconds. Distances
+    are in kilometres.
+    """
+
+    def __init__(self, client=None, cell_size=0.1, max_age=3600,
+                 storeify=True):
+        self.client = client
+        self.cell_size = cell_size
+        self.max_age = max_age
+        self.storeify = storeify
+        self._lng_cells = int(math.ceil(360 / cell_size))
+        self._lat_cells = int(math.ceil(180 / cell_size))
+        self._stores = {}
+        self._cells = {}
+        self._areas = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._stores)
+
+    def __contains__(self, store):
+        return store in self._stores
+
+    def add(self, store):
+        """Index ``store``, replacing any store with the same id. Returns
+        False for stores without coordinates."""
+        point = coordinates(store)
+        if point is None:
+            return False
+        key = store_id(store)
+        cell = self._cell(*point)
+        with self._lock:
+            self._remove(key)
+            self._stores[key] = (point[0], point[1], cell, store)
+            self._cells.setdefault(cell, set()).add(key)
+        return True
+
+    def add_stores(self, stores):
+        for store in stores:
+            self.add(store)
+        return self
+
+    def remove(self, key):
+        with self._lock:
+            return self._remove(key)
+
+    def refresh(self, country=None, zipcode=None, timeout=None):
+        """Reload the stores of one area from store_search. Stores the
+        area listed before but no longer does are dropped unless another
+        loaded area still lists them."""
+        stores = self.client.store_search(country=country, zipcode=zipcode,
+                                          storeify=self.storeify,
+                                          timeout=timeout)
+        area = (country, zipcode)
+        keys = set()
+        with self._lock:
+            for store in stores or ():
+                if self.add(store):
+                    keys.add(store_id(store))
+            previous = self._areas.get(area, (None, set()))[1]
+            self._areas[area] = (now(), keys)
+            listed = set()
+            for other, (loaded, other_keys) in self._areas.items():
+                if other != area:
+                    listed.update(other_keys)
+            for key in previous - keys - listed:
+                self._remove(key)
+        return len(keys)
+
+    def refresh_stale(self, timeout=None):
+        """Refresh every area loaded more than ``max_age`` seconds ago and
+        return how many were refreshed."""
+        expired = now() - self.max_age
+        with self._lock:
+            stale = [area for (area, (loaded, keys)) in self._areas.items()
+                     if loaded <= expired]
+        for country, zipcode in stale:
+            self.refresh(country, zipcode, timeout)
+        return len(stale)
+
+    def areas(self):
+        return list(self._areas)
+
+    def nearby(self, lat, lng, radius):
+        """``(distance, store)`` pairs within ``radius`` km, nearest
+        first."""
+        found = []
+        with self._lock:
+            cells = self._cells_within(lat, lng, radius)
+            if cells is None:
+                keys = list(self._stores)
+            else:
+                keys = [key for cell in cells
+                        for key in self._cells.get(cell, ())]
+            for key in keys:
+                entry = self._stores[key]
+                distance = haversine(lat, lng, entry[0], entry[1])
+                if distance <= radius:
+                    found.append((distance, entry[3]))
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def nearest(self, lat, lng, k=5, radius=None):
+        """The ``k`` stores nearest to ``lat``/``lng`` as ``(distance,
+        store)`` pairs, optionally no further than ``radius`` km. The
+        search radius starts at one cell and doubles until ``k`` stores
+        are in it."""
+        limit = math.pi * EARTH_RADIUS_KM if radius is None else radius
+        search = min(self.cell_size * KM_PER_DEGREE, limit)
+        while True:
+            found = self.nearby(lat, lng, search)
+            if len(found) >= k or search >= limit:
+                return found[:k]
+            search = min(search * 2, limit)
+
+    def _cell(self, lat, lng):
+        row = int(math.floor((lat + 90) / self.cell_size))
+        column = int(math.floor((lng + 180) / self.cell_size))
+        return min(row, self._lat_cells - 1), column % self._lng_cells
+
+    def _cells_within(self, lat, lng, radius):
+        """Cells overlapping the bounding box of the circle of ``radius``
+        km around ``lat``/``lng``, wrapping at the antimeridian. None when
+        there are more of them than occupied cells, scanning every store
+        is cheaper then."""
+        angle = radius / EARTH_RADIUS_KM
+        spread = math.degrees(angle)
+        south, north = max(lat - spread, -90), min(lat + spread, 90)
+        lowest = self._cell(south, lng)[0]
+        highest = self._cell(north, lng)[0]
+        cos_lat = math.cos(math.radians(lat))
+        if (north >= 90 or south <= -90 or angle >= math.pi / 2 or
+                math.sin(angle) >= cos_lat):
+            columns = range(self._lng_cells)
+        else:
+            delta = math.degrees(math.asin(math.sin(angle) / cos_lat))
+            first = int(math.floor((lng - delta + 180) / self.cell_size))
+            last = int(math.floor((lng + delta + 180) / self.cell_size))
+            if last - first + 1 >= self._lng_cells:
+                columns = range(self._lng_cells)
+            else:
+                columns = [column % self._lng_cells
+                           for column in range(first, last + 1)]
+        if (highest - lowest + 1) * len(columns) > len(self._cells):
+            return None
+        return [(row, column) for row in range(lowest, highest + 1)
+                for column in columns]
+
+    def _remove(self, key):
+        entry = self._stores.pop(key, None)
+        if entry is None:
+            return False
+        cell = self._cells[entry[2]]
+        cell.discard(key)
+        if not cell:
+            del self._cells[entry[2]]
+        return True
@@ -7,6 +7,18 @@ class SnoothError(Exception):
     pass
 
 
+class RateLimitExceeded(SnoothError):
+    pass
+
+
+class CircuitOpenError(SnoothError):
+    pass
+
+
+class CassetteMissError(SnoothError):
+    pass
+
+
 def http_error_handler(fn):
     def http_response_wrapper(self, *args, **kwargs):
         response = fn(self, *args, **kwargs)
@@ -16,20 +28,24 @@ def http_error_handler(fn):
     return http_response_wrapper
 
 
+def check_meta(meta, post=None):
+    errmsg = meta['errmsg']
+    if errmsg:
+        raise SnoothError(errmsg)
+    if post and meta['status'] == 1:
+        logging.warning('Successful post')
+    elif post and meta['status'] == 0:
+        logging.warning('Unsuccessful post')
+    elif meta['results'] == 0:
+        logging.warning('Unsuccessful query')
+    return meta
+
+
 def snooth_error_handler(post=None):
     def _snooth_error_handler(fn):
         def snooth_response_wrapper(self, *args, **kwargs):
             snooth_response = fn(self, *args, **kwargs)
-            meta = snooth_response['meta']
-            errmsg = meta['errmsg']
-            if errmsg:
-                raise SnoothError(errmsg)
-            if post and meta['status'] == 1:
-                logging.warning('Successful post')
-            elif post and meta['status'] == 0:
-                logging.warning('Unsuccessful post')
-            elif meta['results'] == 0:
-                logging.warning('Unsuccessful query')
+            check_meta(snooth_response['meta'], post)
             return snooth_response
         return wraps(fn)(snooth_response_wrapper)
     return _snooth_error_handler
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import deque
+from functools import wraps
+from types import GeneratorType
+try:
+    from time import monotonic as now
+except ImportError:
+    from time import time as now
+
+_local = threading.local()
+
+
+def current_event():
+    """RequestEvent of the endpoint call running on this thread, if any."""
+    return getattr(_local, 'event', None)
+
+
+class RequestEvent(object):
+    """Timings and counts for one endpoint call, handed to observers.
+
+    ``connect`` covers DNS resolution, TCP and TLS set up of new
+    connections, ``ttfb`` the time until response headers arrived and
+    ``total`` the whole call including decoding and any retries.
+    """
+
+    __slots__ = (
+        'endpoint', 'started', 'connect', 'connections', 'ttfb', 'total',
+        'bytes', 'decode', 'retries', 'cache_hit', 'results', 'error'
+    )
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = now()
+        self.connect = 0.0
+        self.connections = 0
+        self.ttfb = None
+        self.total = None
+        self.bytes = 0
+        self.decode = 0.0
+        self.retries = 0
+        self.cache_hit = False
+        self.results = None
+        self.error = None
+
+
+class Observer(object):
+    """Interface for SnoothClient observers, override either hook."""
+
+    def before_request(self, event):
+        pass
+
+    def after_request(self, event):
+        pass
+
+
+class Histogram(object):
+    """Count, sum and percentiles over the last ``max_samples`` values."""
+
+    def __init__(self, max_samples=1024):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self.samples.append(value)
+
+    def percentile(self, percent):
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        index = int(round(percent / 100.0 * (len(samples) - 1)))
+        return samples[index]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class MetricsRegistry(object):
+    """In process store of per endpoint counters and histograms."""
+
+    def __init__(self, max_samples=1024):
+        self.max_samples = max_samples
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, endpoint, amount=1):
+        key = (name, endpoint)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, endpoint, value):
+        key = (name, endpoint)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(
+                    self.max_samples
+                )
+        histogram.observe(value)
+
+    def histogram(self, name, endpoint):
+        return self.histograms.get((name, endpoint))
+
+    def snapshot(self):
+        """``{endpoint: {metric: value or summary}}`` of everything
+        recorded so far."""
+        output = {}
+        with self._lock:
+            counters = list(self.counters.items())
+            histograms = list(self.histograms.items())
+        for (name, endpoint), value in counters:
+            output.setdefault(endpoint, {})[name] = value
+        for (name, endpoint), histogram in histograms:
+            output.setdefault(endpoint, {})[name] = histogram.summary()
+        return output
+
+
+class MetricsObserver(Observer):
+    """Observer feeding every finished call into a MetricsRegistry."""
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+
+    def after_request(self, event):
+        registry = self.registry
+        endpoint = event.endpoint
+        registry.increment('requests', endpoint)
+        registry.observe('total_seconds', endpoint, event.total)
+        if event.error is not None:
+            registry.increment('errors', endpoint)
+        if event.cache_hit:
+            registry.increment('cache_hits', endpoint)
+            return
+        if event.retries:
+            registry.increment('retries', endpoint, event.retries)
+        if event.connections:
+            registry.observe('connect_seconds', endpoint, event.connect)
+        if event.ttfb is not None:
+            registry.observe('ttfb_seconds', endpoint, event.ttfb)
+        registry.observe('bytes', endpoint, event.bytes)
+        registry.observe('decode_seconds', endpoint, event.decode)
+        if event.results is not None:
+            registry.observe('results', endpoint, event.results)
+
+
+def result_count(output):
+    if isinstance(output, dict):
+        meta = output.get('meta')
+        if meta is not None:
+            return meta.get('returned', meta.get('results'))
+        return 1
+    try:
+        return len(output)
+    except TypeError:
+        return None
+
+
+def instrumented(endpoint):
+    """Wrap a SnoothClient endpoint so its observers receive a
+    RequestEvent before and after each call. Streamed results are
+    generators, their event ends once the generator is exhausted or
+    closed."""
+    def _instrumented(fn):
+        def instrumented_wrapper(self, *args, **kwargs):
+            if not self.observers:
+                return fn(self, *args, **kwargs)
+            return observe(self.observers, endpoint, fn, self, *args,
+                           **kwargs)
+        return wraps(fn)(instrumented_wrapper)
+    return _instrumented
+
+
+def observe(observers, endpoint, fn, *args, **kwargs):
+    """Call ``fn(*args, **kwargs)`` as one ``endpoint`` call reported to
+    ``observers``."""
+    event = RequestEvent(endpoint)
+    for observer in observers:
+        observer.before_request(event)
+    previous = current_event()
+    _local.event = event
+    streaming = False
+    try:
+        output = fn(*args, **kwargs)
+        if isinstance(output, GeneratorType):
+            streaming = True
+            return _observe_stream(observers, event, output)
+        event.results = result_count(output)
+        return output
+    except Exception as error:
+        event.error = error
+        raise
+    finally:
+        _local.event = previous
+        if not streaming:
+            _finish(observers, event)
+
+
+def _observe_stream(observers, event, records):
+    """Yield from ``records`` with ``event`` current while each record is
+    read, so the bytes and decode time of the body land on it."""
+    event.results = 0
+    try:
+        while True:
+            previous = current_event()
+            _local.event = event
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            finally:
+                _local.event = previous
+            event.results += 1
+            yield record
+    except Exception as error:
+        event.error = error
+        raise
+    finally:
+        records.close()
+        _finish(observers, event)
+
+
+def _finish(observers, event):
+    event.total = now() - event.started
+    for observer in observers:
+        observer.after_request(event)
+
+
+def timed_connection(connection_class):
+    """Subclass of an urllib3 connection class that adds the time spent
+    opening each connection to the current RequestEvent."""
+    class TimedConnection(connection_class):
+
+        def connect(self):
+            started = now()
+            try:
+                return super(TimedConnection, self).connect()
+            finally:
+                event = current_event()
+                if event is not None:
+                    event.connect += now() - started
+                    event.connections += 1
+
+    TimedConnection.__name__ = 'Timed' + connection_class.__name__
+    return TimedConnection
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+from operator import attrgetter
+
+# Records being packed in this worker process, set by the pool
+# initializer. Forked workers inherit the initializer arguments, so shards
+# are sent as index ranges instead of pickled records.
+_records = None
+
+
+def _context():
+    """Fork context where the platform has one, None to send records to
+    the workers with each shard."""
+    get_context = getattr(multiprocessing, 'get_context', None)
+    if get_context is None:
+        return multiprocessing if hasattr(os, 'fork') else None
+    try:
+        return get_context('fork')
+    except ValueError:
+        return None
+
+
+def pack_columns(model, records, names=None):
+    """One list per field in ``names``, every model field by default,
+    holding the values ``model(record)`` would carry. Equal strings are
+    stored once so they pickle once."""
+    fields = attrgetter(*(names or model._field_names()))
+    rows = [fields(model(record)) for record in records]
+    strings = {}
+    shared = strings.setdefault
+    return [
+        [shared(value, value) if value.__class__ is str else value
+         for value in column]
+        for column in zip(*rows)
+    ]
+
+
+def _set_records(records):
+    global _records
+    _records = records
+
+
+def _pack_range(task):
+    model, names, start, stop = task
+    return pack_columns(model, _records[start:stop], names)
+
+
+def _pack_shard(task):
+    model, names, records = task
+    return pack_columns(model, records, names)
+
+
+class PackedRecords(object):
+    """Sequence of model objects stored as one list per field.
+
+    Objects are built when indexed or iterated, the ``column`` lists can
+    be read directly without building any. ``constants`` are fields every
+    object shares, such as a Wine's credentials, and ``client`` the
+    SnoothClient the objects belong to.
+    """
+
+    def __init__(self, model, columns=None, constants=None, client=None):
+        self.model = model
+        self.constants = constants or {}
+        self.names = tuple(name for name in model._field_names()
+                           if name not in self.constants)
+        self.columns = columns or [[] for _ in self.names]
+        self.client = client
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        instance = self.model.__new__(self.model)
+        instance._client = self.client
+        for name, column in zip(self.names, self.columns):
+            setattr(instance, name, column[position])
+        for name, value in self.constants.items():
+            setattr(instance, name, value)
+        return instance
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def column(self, name):
+        return self.columns[self.names.index(name)]
+
+    def add_column(self, name, values):
+        """Set ``name`` to ``values[position]`` on the object built for
+        each position, for attributes outside the model's field names."""
+        self.names += (name,)
+        self.columns.append(values)
+
+    def extend(self, columns):
+        for column, values in zip(self.columns, columns):
+            column.extend(values)
+
+
+def pack(model, records, processes=None, chunk_size=20000, constants=None,
+         client=None):
+    """PackedRecords of ``model(record)`` for every record, converted in
+    shards of ``chunk_size`` records across ``processes`` worker
+    processes (one per CPU when None)."""
+    records = records if isinstance(records, list) else list(records)
+    packed = PackedRecords(model, constants=constants, client=client)
+    bounds = [(start, min(start + chunk_size, len(records)))
+              for start in range(0, len(records), chunk_size)]
+    names = packed.names
+    if len(bounds) < 2:
+        packed.extend(pack_columns(model, records, names))
+        return packed
+    context = _context()
+    if context is not None:
+        pool = context.Pool(processes, initializer=_set_records,
+                            initargs=(records,))
+        tasks = [(model, names, start, stop) for (start, stop) in bounds]
+        worker = _pack_range
+    else:
+        pool = multiprocessing.Pool(processes)
+        tasks = [(model, names, records[start:stop])
+                 for (start, stop) in bounds]
+        worker = _pack_shard
+    try:
+        for columns in pool.imap(worker, tasks):
+            packed.extend(columns)
+    finally:
+        pool.terminate()
+        pool.join()
+    return packed
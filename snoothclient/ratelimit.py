@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from handlers import RateLimitExceeded
+try:
+    from time import monotonic as now
+except ImportError:
+    from time import time as now
+
+DAY = 86400
+
+
+class RateLimiter(object):
+    """Token bucket pacing requests to ``rate`` per second with bursts of up
+    to ``burst``, plus an optional ``daily`` request quota counted per UTC
+    day.
+
+    reserve() hands out slots in arrival order and returns how long the
+    caller has to wait for its slot, which lets threads sleep and
+    coroutines await on the same limiter. What happens when no token is
+    free depends on ``mode``:
+
+    - ``'block'`` waits however long it takes,
+    - ``'queue'`` waits unless the backlog exceeds ``max_wait`` seconds,
+    - ``'fail'`` raises RateLimitExceeded straight away.
+
+    An exhausted daily quota always raises RateLimitExceeded.
+    """
+
+    MODES = ('block', 'queue', 'fail')
+
+    def __init__(self, rate=None, burst=None, daily=None, mode='block',
+                 max_wait=None):
+        if mode not in self.MODES:
+            raise ValueError('mode must be one of %s' % (self.MODES,))
+        self.rate = rate
+        self.burst = burst or (max(1, int(rate)) if rate else None)
+        self.daily = daily
+        self.mode = mode
+        self.max_wait = max_wait
+        self._tokens = self.burst
+        self._updated = now()
+        self._day = None
+        self._used_today = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it."""
+        with self._lock:
+            self._roll_day()
+            if self.daily is not None and self._used_today >= self.daily:
+                raise RateLimitExceeded('Daily quota of %d requests used'
+                                        % self.daily)
+            delay = 0
+            if self.rate:
+                self._refill()
+                if self._tokens < 1:
+                    delay = (1 - self._tokens) / self.rate
+                    if self.mode == 'fail' or (
+                            self.mode == 'queue' and
+                            self.max_wait is not None and
+                            delay > self.max_wait):
+                        raise RateLimitExceeded(
+                            'Rate limit of %s requests per second reached'
+                            % self.rate
+                        )
+                self._tokens -= 1
+            self._used_today += 1
+            return delay
+
+    def acquire(self):
+        """Blocking reserve for threaded callers."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def remaining(self):
+        """Tokens free right now and requests left in today's quota, None
+        when the respective limit is not set."""
+        with self._lock:
+            self._roll_day()
+            tokens = None
+            if self.rate:
+                self._refill()
+                tokens = max(0, int(self._tokens))
+            daily = None
+            if self.daily is not None:
+                daily = max(0, self.daily - self._used_today)
+            return {'second': tokens, 'daily': daily}
+
+    def _refill(self):
+        timestamp = now()
+        elapsed = timestamp - self._updated
+        self._updated = timestamp
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+
+    def _roll_day(self):
+        day = int(time.time() // DAY)
+        if day != self._day:
+            self._day = day
+            self._used_today = 0
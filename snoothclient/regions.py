@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+try:
+    from sys import intern
+except ImportError:
+    def intern(string, _intern=intern):
+        # Python 2 only interns byte strings.
+        try:
+            return _intern(string)
+        except TypeError:
+            return string
+
+REGION_SEPARATOR = ' > '
+# Distinct region strings whose split is remembered, the catalog has a few
+# thousand.
+MAX_SPLITS = 50000
+
+_splits = {}
+
+
+def split_region(region):
+    """Split a Snooth "Country > Region > Sub > Sub > Localities" string
+    into ``(country, region, sub_region1, sub_region2, localities)``.
+    Missing levels are '', localities is a list only when present.
+
+    Levels are interned and splits remembered, so every wine from one
+    region holds the same level strings.
+    """
+    levels = _splits.get(region)
+    if levels is None:
+        locs = [intern(level) for level in
+                (region or '').split(REGION_SEPARATOR)]
+        levels = tuple(locs[:4]) + ('',) * (4 - len(locs[:4]))
+        levels += (tuple(locs[4:]) if len(locs) > 4 else '',)
+        if len(_splits) < MAX_SPLITS:
+            _splits[region] = levels
+    if levels[4]:
+        return levels[:4] + (list(levels[4]),)
+    return levels
+
+
+def region_path(wine):
+    """Region levels of a raw wine dict or a Wine, empty levels dropped."""
+    if isinstance(wine, dict):
+        region = wine.get('region') or ''
+        return [level for level in region.split(REGION_SEPARATOR) if level]
+    levels = [wine.country, wine.region, wine.sub_region1, wine.sub_region2]
+    levels.extend(wine.localities or [])
+    return [level for level in levels if level]
+
+
+class RegionIndex(object):
+    """Trie of region hierarchies shared by a set of wines.
+
+    Each "Country > Region > Sub" node is interned once and identified by
+    an integer id; wines are filed under the id of their deepest level.
+    Node 0 is the root above the countries. Subtree totals are kept up to
+    date on insert, so counts are read without walking the wines.
+    """
+
+    ROOT = 0
+
+    def __init__(self):
+        self.names = ['']
+        self.parents = [None]
+        self._children = [{}]
+        self._wines = [[]]
+        self._totals = [0]
+        self._by_name = {}
+        self._paths = {}
+
+    def __len__(self):
+        return self._totals[self.ROOT]
+
+    def node(self, region):
+        """Id of the node for ``region``, a separated string or a list of
+        levels, creating missing nodes along the way."""
+        if not isinstance(region, list):
+            node = self._paths.get(region)
+            if node is not None:
+                return node
+            levels = [level for level in (region or '').split(
+                REGION_SEPARATOR) if level]
+        else:
+            levels = region
+        node = self.ROOT
+        for level in levels:
+            child = self._children[node].get(level)
+            if child is None:
+                child = self._create(node, level)
+            node = child
+        if not isinstance(region, list):
+            self._paths[region] = node
+        return node
+
+    def add(self, wine, region=None):
+        """File ``wine`` under its region, or under ``region`` when given,
+        and return the node id."""
+        if region is None:
+            if isinstance(wine, dict):
+                region = wine.get('region') or ''
+            else:
+                region = region_path(wine)
+        node = self.node(region)
+        self._wines[node].append(wine)
+        parent = node
+        while parent is not None:
+            self._totals[parent] += 1
+            parent = self.parents[parent]
+        return node
+
+    def add_wines(self, wines):
+        for wine in wines:
+            self.add(wine)
+        return self
+
+    def path(self, node):
+        levels = []
+        while node:
+            levels.append(self.names[node])
+            node = self.parents[node]
+        return levels[::-1]
+
+    def find(self, region):
+        """Node ids matching ``region``: a full path such as
+        "France > Bordeaux" or a single level name such as "Bordeaux",
+        which may occur under several parents."""
+        if REGION_SEPARATOR in region:
+            node = self.ROOT
+            for level in region.split(REGION_SEPARATOR):
+                node = self._children[node].get(level)
+                if node is None:
+                    return []
+            return [node]
+        return list(self._by_name.get(region, ()))
+
+    def wines_under(self, region):
+        """Every wine filed at or below the nodes matching ``region``."""
+        wines = []
+        stack = self.find(region)
+        while stack:
+            node = stack.pop()
+            wines.extend(self._wines[node])
+            stack.extend(self._children[node].values())
+        return wines
+
+    def count_under(self, region):
+        return sum(self._totals[node] for node in self.find(region))
+
+    def counts(self, region=None):
+        """Wine totals per direct sub-region of ``region``, per country
+        when ``region`` is None."""
+        nodes = [self.ROOT] if region is None else self.find(region)
+        output = {}
+        for node in nodes:
+            for name, child in self._children[node].items():
+                output[name] = output.get(name, 0) + self._totals[child]
+        return output
+
+    def _create(self, parent, name):
+        name = intern(name)
+        node = len(self.names)
+        self.names.append(name)
+        self.parents.append(parent)
+        self._children.append({})
+        self._wines.append([])
+        self._totals.append(0)
+        self._children[parent][name] = node
+        self._by_name.setdefault(name, []).append(node)
+        return node
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+from functools import wraps
+from handlers import CircuitOpenError
+from metrics import current_event
+try:
+    from time import monotonic as now
+except ImportError:
+    from time import time as now
+
+
+def error_status(error):
+    """HTTP status carried by a requests or aiohttp error, if any."""
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        status = getattr(error, 'status', None)
+    return status
+
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or \
+        getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy(object):
+    """Retry transient failures with jittered exponential backoff.
+
+    Connection errors, timeouts and ``statuses`` responses are retried up
+    to ``retries`` times. Attempt ``n`` waits a random time up to
+    ``backoff * 2 ** n`` seconds, capped at ``max_backoff`` and raised to
+    a 429's Retry-After. ``deadline`` bounds the time spent on one call
+    across all attempts, per attempt timeouts shrink to fit in it.
+    """
+
+    def __init__(self, retries=3, backoff=0.1, max_backoff=5, jitter=True,
+                 deadline=None, statuses=(429, 500, 502, 503, 504)):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.statuses = statuses
+
+    def start(self):
+        if self.deadline is None:
+            return None
+        return now() + self.deadline
+
+    def timeout(self, timeout, deadline):
+        """Per attempt timeout, never beyond the call deadline."""
+        if deadline is None:
+            return timeout
+        remaining = max(deadline - now(), 0.001)
+        if not timeout:
+            return remaining
+        return min(timeout, remaining)
+
+    def delay(self, attempt, error, transient, deadline):
+        """Seconds to wait before retrying, None to give up."""
+        if attempt >= self.retries:
+            return None
+        status = error_status(error)
+        if not isinstance(error, transient) and status not in self.statuses:
+            return None
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if status == 429:
+            delay = max(delay, retry_after(error) or 0)
+        if deadline is not None and now() + delay >= deadline:
+            return None
+        return delay
+
+
+class CircuitBreaker(object):
+    """Stop calling the API after ``failures`` consecutive transient
+    failures. While open every call raises CircuitOpenError; after
+    ``reset_timeout`` seconds one trial call is let through and its outcome
+    closes or reopens the circuit."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failures=5, reset_timeout=30):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._count = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def before(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if (self.state == self.OPEN and
+                    now() - self._opened >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpenError('Snooth API circuit is open')
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._count = 0
+
+    def release(self):
+        """Undo ``before`` for a call that never reached the API. A half
+        open circuit reopens with its timer already run out, so the next
+        call becomes the trial."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self.state == self.HALF_OPEN or self._count >= self.failures:
+                self.state = self.OPEN
+                self._opened = now()
+
+    def record(self, error, transient):
+        """Count ``error`` as a failure if it points at an API outage and
+        as a success if the API answered it. Errors raised before any
+        request went out, such as RateLimitExceeded, leave the count
+        alone."""
+        status = error_status(error)
+        if isinstance(error, transient) or (status and status >= 500):
+            self.failure()
+        elif status is not None:
+            self.success()
+        else:
+            self.release()
+
+
+def retry_handler(idempotent=False):
+    """Run a transport method through the client's circuit breaker and,
+    for idempotent methods, its retry policy."""
+    def _retry_handler(fn):
+        def retry_wrapper(self, url, params, timeout, **kwargs):
+            policy = self.retry if idempotent else None
+            breaker = self.breaker
+            deadline = policy.start() if policy is not None else None
+            attempt = 0
+            while True:
+                if breaker is not None:
+                    breaker.before()
+                if policy is not None:
+                    attempt_timeout = policy.timeout(timeout, deadline)
+                else:
+                    attempt_timeout = timeout
+                try:
+                    response = fn(self, url, params, attempt_timeout,
+                                  **kwargs)
+                except Exception as error:
+                    transient = self.transient_errors()
+                    if breaker is not None:
+                        breaker.record(error, transient)
+                    delay = None
+                    if policy is not None:
+                        delay = policy.delay(attempt, error,
+                                             transient, deadline)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    event = current_event()
+                    if event is not None:
+                        event.retries += 1
+                    continue
+                if breaker is not None:
+                    breaker.success()
+                return response
+        return wraps(fn)(retry_wrapper)
+    return _retry_handler
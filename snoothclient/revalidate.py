@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import threading
+try:
+    from time import monotonic as now
+except ImportError:
+    from time import time as now
+
+
+class Revalidator(object):
+    """Stale while revalidate policy for a SnoothClient's response cache.
+
+    For the ``endpoints`` it covers, cached entries are served up to
+    ``stale`` seconds past their expiry while a background refresh fetches
+    a fresh copy. Hot entries, read at least ``min_hits`` times over the
+    last one to two ``window`` seconds, are refreshed ahead of time once
+    they are within ``ahead`` seconds of expiring. At most
+    ``max_refreshes`` refreshes run at once; entries due while the cap is
+    reached are served as they are and retried on a later read.
+    """
+
+    ENDPOINTS = ('wine_detail', 'store_detail', 'winery_detail')
+
+    def __init__(self, stale=60, ahead=30, min_hits=3, window=60,
+                 max_refreshes=2, endpoints=None):
+        self.stale = stale
+        self.ahead = ahead
+        self.min_hits = min_hits
+        self.window = window
+        self.max_refreshes = max_refreshes
+        self.endpoints = tuple(endpoints or self.ENDPOINTS)
+        self.refreshes = 0
+        self.skipped = 0
+        self.errors = 0
+        self._counts = {}
+        self._previous = {}
+        self._window_start = now()
+        self._refreshing = set()
+        self._condition = threading.Condition()
+
+    def touch(self, key):
+        """Count a read of ``key`` and return its reads in the current and
+        previous window."""
+        with self._condition:
+            if now() - self._window_start >= self.window:
+                self._previous = self._counts
+                self._counts = {}
+                self._window_start = now()
+            hits = self._counts[key] = self._counts.get(key, 0) + 1
+            return hits + self._previous.get(key, 0)
+
+    def due(self, remaining, hits):
+        """Whether an entry expiring in ``remaining`` seconds (negative
+        once expired) and read ``hits`` times should be refreshed."""
+        if remaining <= 0:
+            return True
+        return remaining <= self.ahead and hits >= self.min_hits
+
+    def refresh(self, key, fn, *args):
+        """Run ``fn(*args)`` in a background thread unless ``key`` is
+        already refreshing or the cap is reached. Returns whether a
+        refresh was started."""
+        with self._condition:
+            if (key in self._refreshing or
+                    len(self._refreshing) >= self.max_refreshes):
+                self.skipped += 1
+                return False
+            self._refreshing.add(key)
+        thread = threading.Thread(target=self._run, args=(key, fn, args))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def wait(self, timeout=None):
+        """Wait for running refreshes to finish. Returns False if
+        ``timeout`` seconds passed first."""
+        deadline = None if timeout is None else now() + timeout
+        with self._condition:
+            while self._refreshing:
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - now()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+        return True
+
+    def stats(self):
+        return {
+            'refreshes': self.refreshes,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'refreshing': len(self._refreshing)
+        }
+
+    def _run(self, key, fn, args):
+        try:
+            fn(*args)
+            succeeded = True
+        except Exception:
+            succeeded = False
+        with self._condition:
+            if succeeded:
+                self.refreshes += 1
+            else:
+                self.errors += 1
+            self._refreshing.discard(key)
+            self._condition.notify_all()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import codecs
+import json
+import re
+from handlers import SnoothError, check_meta
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER = '-0123456789'
+
+
+class RecordParser(object):
+    """Incremental parser for a Snooth response body.
+
+    Bytes are pushed in with feed(), which returns the elements of the
+    ``key`` list (``'wines'``, ``'stores'``, ``'actions'``) completed so
+    far. The meta block is checked with check_meta as soon as it has been
+    read and records are only released after it passed, so an API error
+    raises before any result is handed out. Only the record being parsed
+    and the unread tail of the body are kept in memory.
+    """
+
+    def __init__(self, key, post=None):
+        self.key = key
+        self.post = post
+        self.meta = None
+        self.done = False
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._state = 'start'
+        self._field = None
+        self._pending = []
+
+    def feed(self, data):
+        self._buffer += self._text.decode(data)
+        return self._parse()
+
+    def close(self):
+        """Signal the end of the body and return the last records."""
+        self._buffer += self._text.decode(b'', True)
+        records = self._parse()
+        if not self.done or self.meta is None:
+            raise SnoothError('Incomplete or invalid response.')
+        return records
+
+    def _parse(self):
+        records = []
+        while not self.done:
+            self._position = WHITESPACE.match(self._buffer,
+                                              self._position).end()
+            if self._position >= len(self._buffer):
+                break
+            if self._state in ('key', 'value', 'records', 'element'):
+                if not self._value(records):
+                    break
+            else:
+                self._step(self._buffer[self._position])
+        if self._position > 65536:
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+        return records
+
+    def _step(self, char):
+        state = self._state
+        if state == 'start':
+            self._expect(char, '{')
+            self._state = 'field'
+        elif state in ('field', 'after_value') and char == '}':
+            self._position += 1
+            self.done = True
+        elif state == 'field':
+            self._state = 'key'
+        elif state == 'after_value':
+            self._expect(char, ',')
+            self._state = 'key'
+        elif state == 'colon':
+            self._expect(char, ':')
+            self._state = 'records' if self._field == self.key else 'value'
+        elif state == 'list' and char == ']':
+            self._position += 1
+            self._state = 'after_value'
+        elif state == 'list':
+            self._state = 'element'
+        elif state == 'separator' and char == ']':
+            self._position += 1
+            self._state = 'after_value'
+        elif state == 'separator':
+            self._expect(char, ',')
+            self._state = 'element'
+
+    def _value(self, records):
+        """Decode the value at the current position. Returns False when the
+        buffer does not hold all of it yet."""
+        if self._state == 'records':
+            if self._buffer[self._position] == '[':
+                self._position += 1
+                self._state = 'list'
+                return True
+            self._state = 'value'
+        try:
+            value, end = self._decoder.raw_decode(self._buffer,
+                                                  self._position)
+        except ValueError:
+            return False
+        # A value running to the end of the buffer may still be cut short,
+        # a number for instance, wait for the next character. A number
+        # followed by more number characters was cut after a '.', 'e' or
+        # sign and decoded without them.
+        if end >= len(self._buffer) or (
+                self._buffer[self._position] in NUMBER and
+                self._buffer[end] in NUMBER + '.eE+'):
+            return False
+        self._position = end
+        if self._state == 'key':
+            self._field = value
+            self._state = 'colon'
+        elif self._state == 'element':
+            self._emit(value, records)
+            self._state = 'separator'
+        else:
+            if self._field == 'meta':
+                self.meta = check_meta(value, self.post)
+                records.extend(self._pending)
+                self._pending = []
+            elif self._field == self.key and isinstance(value, list):
+                for record in value:
+                    self._emit(record, records)
+            self._state = 'after_value'
+        return True
+
+    def _emit(self, record, records):
+        if self.meta is None:
+            self._pending.append(record)
+        else:
+            records.append(record)
+
+    def _expect(self, char, expected):
+        if char != expected:
+            raise SnoothError('Invalid response.')
+        self._position += 1
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import json
+import os
+import threading
+
+replace = getattr(os, 'replace', os.rename)
+
+
+def fingerprint(wine):
+    """Short digest of a wine_search record, changes whenever any of its
+    fields do."""
+    serialized = json.dumps(wine, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(serialized).hexdigest()[:16]
+
+
+class CatalogSnapshot(object):
+    """Append only JSON lines file of wines with an in memory index from
+    wine code to file offset.
+
+    Each line holds ``code``, the ``fingerprint`` of the wine_search record
+    it was built from and the merged ``wine``. A later line for a code
+    supersedes earlier ones; compact rewrites the file keeping only the
+    latest. A torn last line left by a crash is cut off on open.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+        self.fingerprints = {}
+        self._lock = threading.Lock()
+        self._load()
+        self._file = io.open(path, 'ab')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, code):
+        return code in self.offsets
+
+    def __iter__(self):
+        for code in list(self.offsets):
+            yield self.get(code)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def codes(self):
+        return list(self.offsets)
+
+    def get(self, code):
+        offset = self.offsets.get(code)
+        if offset is None:
+            return None
+        with io.open(self.path, 'rb') as snapshot_file:
+            snapshot_file.seek(offset)
+            line = snapshot_file.readline()
+        return json.loads(line.decode('utf-8'))['wine']
+
+    def append(self, entries):
+        """Write ``(code, fingerprint, wine)`` entries and flush them to
+        disk before returning."""
+        with self._lock:
+            for code, digest, wine in entries:
+                line = json.dumps({'code': code, 'fingerprint': digest,
+                                   'wine': wine}, sort_keys=True)
+                offset = self._file.tell()
+                self._file.write((line + '\n').encode('utf-8'))
+                self.offsets[code] = offset
+                self.fingerprints[code] = digest
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def compact(self):
+        """Rewrite the file with one line per code."""
+        with self._lock:
+            self._file.close()
+            temporary = self.path + '.compact'
+            offsets = {}
+            with io.open(self.path, 'rb') as source:
+                with io.open(temporary, 'wb') as target:
+                    for code, offset in self.offsets.items():
+                        source.seek(offset)
+                        offsets[code] = target.tell()
+                        target.write(source.readline())
+                    target.flush()
+                    os.fsync(target.fileno())
+            replace(temporary, self.path)
+            self.offsets = offsets
+            self._file = io.open(self.path, 'ab')
+
+    def close(self):
+        self._file.close()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        good = 0
+        with io.open(self.path, 'rb') as snapshot_file:
+            for line in snapshot_file:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('Torn line')
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                self.offsets[entry['code']] = good
+                self.fingerprints[entry['code']] = entry['fingerprint']
+                good += len(line)
+        if good != os.path.getsize(self.path):
+            with io.open(self.path, 'r+b') as snapshot_file:
+                snapshot_file.truncate(good)
+
+
+class CatalogSync(object):
+    """Crawl a slice of the catalog into a CatalogSnapshot.
+
+    ``filters`` are wine_search arguments selecting the slice, e.g.
+    ``country='fr', color='red', min_price=10, max_price=20``. Pages of
+    ``count`` wines are read in order and only wines that are new or whose
+    search record changed since the snapshot was written are fetched with
+    wine_detail, ``workers`` at a time. After each page the snapshot is
+    flushed and a checkpoint saved, so an interrupted run picks up at the
+    page it stopped on.
+    """
+
+    def __init__(self, client, path, count=100, workers=8, detail=None,
+                 **filters):
+        self.client = client
+        self.path = path
+        self.checkpoint_path = path + '.checkpoint'
+        self.count = count
+        self.workers = workers
+        self.detail = detail or {}
+        self.filters = filters
+        self.stats = {}
+
+    def run(self, timeout=None):
+        """Sync the slice and return the stats of this run: ``pages``,
+        ``seen``, ``unchanged``, ``updated`` and ``errors`` (wine code to
+        exception for failed wine_detail lookups, retried next run)."""
+        self.stats = {'pages': 0, 'seen': 0, 'unchanged': 0, 'updated': 0,
+                      'errors': {}}
+        first_result = self._load_checkpoint()
+        with CatalogSnapshot(self.path) as snapshot:
+            while True:
+                python_response = self.client.wine_search(
+                    meta=True, count=self.count, first_result=first_result,
+                    timeout=timeout, **self.filters
+                )
+                wines = python_response.get('wines') or []
+                self._sync_page(snapshot, wines)
+                first_result += len(wines)
+                total = int(python_response['meta'].get('results') or 0)
+                if not wines or first_result > total:
+                    break
+                self._save_checkpoint(first_result)
+        self._clear_checkpoint()
+        return self.stats
+
+    def _sync_page(self, snapshot, wines):
+        changed = {}
+        for wine in wines:
+            digest = fingerprint(wine)
+            if snapshot.fingerprints.get(wine['code']) == digest:
+                self.stats['unchanged'] += 1
+            else:
+                changed[wine['code']] = (digest, wine)
+        codes = list(changed)
+        details, errors = self.client.wine_details(codes, self.workers,
+                                                   **self.detail)
+        entries = []
+        for code, detail in zip(codes, details):
+            if detail is None:
+                continue
+            digest, wine = changed[code]
+            merged = dict(wine)
+            merged.update(detail)
+            entries.append((code, digest, merged))
+        snapshot.append(entries)
+        self.stats['pages'] += 1
+        self.stats['seen'] += len(wines)
+        self.stats['updated'] += len(entries)
+        self.stats['errors'].update(errors)
+
+    def _checkpoint_state(self):
+        return {'filters': self.filters, 'count': self.count}
+
+    def _load_checkpoint(self):
+        """First result to resume from, 1 without a checkpoint for this
+        slice."""
+        try:
+            with io.open(self.checkpoint_path, 'rb') as checkpoint_file:
+                checkpoint = json.loads(
+                    checkpoint_file.read().decode('utf-8')
+                )
+        except (IOError, ValueError):
+            return 1
+        if checkpoint.get('state') != self._checkpoint_state():
+            return 1
+        return checkpoint['next']
+
+    def _save_checkpoint(self, first_result):
+        temporary = self.checkpoint_path + '.tmp'
+        with io.open(temporary, 'wb') as checkpoint_file:
+            checkpoint_file.write(json.dumps({
+                'state': self._checkpoint_state(), 'next': first_result
+            }, sort_keys=True).encode('utf-8'))
+        replace(temporary, self.checkpoint_path)
+
+    def _clear_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
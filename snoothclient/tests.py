@@ -1,9 +1,51 @@
 # -*- coding: utf-8 -*-
+import gzip
+import io
+import json
 import os
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 import unittest
-from requests import Timeout
-from client import SnoothClient, Wine, WineStore
+from multiprocessing.pool import ThreadPool
+from requests import ConnectionError, HTTPError, Timeout
+from client import LazyWine, SnoothClient, Wine, WineStore, Winery
+from batch import WineBatch
+from cache import ResponseCache, SQLiteCache
+from cassette import Cassette
+import decoders
+from decoders import JSONDecoder
+from fakeserver import FakeSnoothServer
+from geo import StoreIndex, haversine
+from handlers import (CassetteMissError, CircuitOpenError, RateLimitExceeded,
+                      SnoothError)
+from metrics import Histogram, MetricsObserver, Observer
+from ratelimit import RateLimiter
+from regions import RegionIndex, region_path
+from retry import CircuitBreaker, RetryPolicy
+from revalidate import Revalidator
+from streaming import RecordParser
+from sync import CatalogSnapshot, CatalogSync
+from writes import WriteQueue
+try:
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from urlparse import parse_qs, urlparse
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+try:
+    import asyncio
+    from aiohttp import ClientResponseError
+    from async_client import AsyncSingleFlight, AsyncSnoothClient
+except ImportError:
+    AsyncSnoothClient = None
 try:
     API_KEY = os.environ['API_KEY']
 except KeyError:
@@ -109,5 +151,1748 @@ class SnoothWineTests(unittest.TestCase):
             timeout=0.0000000000000000001
         )
 
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.server.requests.append(self.path)
+        time.sleep(self.server.delay)
+        payload = self.server.payload
+        if callable(payload):
+            payload = payload(self.path)
+        body = json.dumps(payload).encode('utf-8')
+        status = self.server.status
+        if self.server.failures:
+            status = self.server.failures.pop(0)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+    do_PUT = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, payload):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.payload = payload
+        self.status = 200
+        self.delay = 0
+        self.failures = []
+        self.connections = set()
+        self.requests = []
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def point(self, client):
+        for attr in dir(client):
+            if attr.endswith('_URL'):
+                path = getattr(client, attr).replace(
+                    'https://api.snooth.com', ''
+                )
+                setattr(client, attr, self.url + path)
+        return client
+
+
+STUB_WINES = {
+    'meta': {'results': 2, 'returned': 2, 'errmsg': '', 'status': 1},
+    'wines': [
+        {'name': 'Recougne', 'code': 'chateau-recougne-2009',
+         'region': 'France > Bordeaux > Bordeaux Superieur',
+         'price': '12.99', 'available': 1},
+        {'name': 'Malbec', 'code': 'catena-malbec-2010',
+         'region': 'Argentina > Mendoza', 'price': '19.99',
+         'available': 0}
+    ]
+}
+
+
+class SnoothModelTests(unittest.TestCase):
+
+    def test_wine_slots(self):
+        wine = Wine(STUB_WINES['wines'][0], username='me')
+        self.assertFalse(hasattr(wine, '__dict__'))
+        self.assertRaises(AttributeError, setattr, wine, 'colour', 'red')
+        properties = wine.properties()
+        self.assertEqual(properties['region'], 'Bordeaux')
+        self.assertEqual(properties['sub_region1'], 'Bordeaux Superieur')
+        self.assertEqual(properties['username'], 'me')
+        self.assertTrue(properties['available'])
+        self.assertEqual(len(properties), 22)
+        self.assertFalse('region_id' in wine.fields())
+        self.assertEqual(wine.fields()[:3], ['username', 'password', 'name'])
+        self.assertEqual(wine.values()[3], 'chateau-recougne-2009')
+
+    def test_lazy_wine(self):
+        raw = dict(STUB_WINES['wines'][0], region='A > B > C > D > E > F')
+        wine = LazyWine(raw, username='me')
+        self.assertTrue(isinstance(wine, Wine))
+        self.assertEqual(wine.code, 'chateau-recougne-2009')
+        self.assertRaises(AttributeError, object.__getattribute__, wine,
+                          'country')
+        self.assertEqual(wine.sub_region2, 'D')
+        self.assertEqual(object.__getattribute__(wine, 'country'), 'A')
+        self.assertRaises(AttributeError, getattr, wine, 'colour')
+        self.assertEqual(wine.properties(), Wine(raw, 'me').properties())
+        self.assertFalse('_raw' in wine.fields())
+
+    def test_region_levels_shared(self):
+        first = Wine({'region': ''.join(['France > ', 'Bordeaux'])})
+        second = LazyWine({'region': ''.join(['France > ', 'Bordeaux'])})
+        self.assertTrue(first.region is second.region)
+        self.assertTrue(first.country is WineBatch.from_wines(
+            [{'region': 'France > Loire'}]
+        )['country'][0])
+
+    def test_wineify_index(self):
+        snooth = SnoothClient(api_key='stub')
+        index = RegionIndex()
+        wines = snooth.wineify(BATCH_WINES, index=index)
+        self.assertEqual(wines[0].region_id,
+                         index.node('France > Bordeaux > Bordeaux Superieur'))
+        self.assertEqual(index.path(wines[1].region_id),
+                         ['Argentina', 'Mendoza'])
+        self.assertEqual(index.count_under('France'), 2)
+        self.assertTrue(snooth.wineify(BATCH_WINES)[0].region_id is None)
+        self.assertTrue(LazyWine(BATCH_WINES[0]).region_id is None)
+
+    def test_wineify_lazy(self):
+        snooth = SnoothClient(api_key='stub', lazy_wines=True)
+        wines = snooth.wineify(STUB_WINES['wines'])
+        self.assertTrue(isinstance(wines[0], LazyWine))
+        self.assertFalse(wines[1].available)
+        wines = snooth.wineify(STUB_WINES['wines'], lazy=False)
+        self.assertFalse(isinstance(wines[0], LazyWine))
+
+    def test_store_and_winery_slots(self):
+        store = WineStore({'id': 7, 'lat': 41.6, 'lng': -91.5, 'closed': 1})
+        self.assertFalse(hasattr(store, '__dict__'))
+        self.assertEqual(store.fields()[0], 'name')
+        self.assertEqual(store.fields()[-1], 'rating')
+        self.assertTrue(store.properties()['closed'])
+        winery = Winery({'id': 'chateau-recougne', 'zip': '33133'})
+        self.assertEqual(len(winery.properties()), 13)
+        self.assertEqual(winery.properties()['zip'], '33133')
+
+
+class ParallelConvertTests(unittest.TestCase):
+
+    def setUp(self):
+        fake = FakeSnoothServer.__new__(FakeSnoothServer)
+        fake.padding = 0
+        self.wines = [fake.wine(index) for index in range(1, 251)]
+        self.stores = [fake.store(index) for index in range(120)]
+        self.snooth = SnoothClient(api_key='stub', username='me')
+
+    def test_wineify_processes(self):
+        packed = self.snooth.wineify(self.wines, password='pw',
+                                     processes=2, chunk_size=40)
+        self.assertEqual(len(packed), 250)
+        serial = self.snooth.wineify(self.wines, password='pw')
+        self.assertEqual([wine.properties() for wine in packed],
+                         [wine.properties() for wine in serial])
+        self.assertTrue(packed[-1].client is self.snooth)
+        self.assertEqual(packed[3:5][1].code, 'wine-5')
+        self.assertEqual(packed.column('code')[0], 'wine-1')
+        self.assertFalse('username' in packed.names)
+        regions = packed.column('region')
+        self.assertTrue(regions[0] is regions[8])
+
+    def test_wineify_processes_index(self):
+        index = RegionIndex()
+        packed = self.snooth.wineify(self.wines, processes=2, chunk_size=40,
+                                     index=index)
+        self.assertEqual(len(index), 250)
+        self.assertEqual(index.path(packed[7].region_id),
+                         region_path(self.wines[7]))
+        self.assertEqual(len(packed[7].properties()), 22)
+        self.assertTrue(self.snooth.wineify(
+            self.wines, processes=2, chunk_size=40
+        )[7].region_id is None)
+
+    def test_storeify_processes(self):
+        packed = self.snooth.storeify(self.stores, processes=2,
+                                      chunk_size=50)
+        self.assertEqual([store.properties() for store in packed],
+                         [store.properties() for store
+                          in self.snooth.storeify(self.stores)])
+        self.assertEqual(len(self.snooth.storeify([], processes=2)), 0)
+
+    def test_concurrent_packs(self):
+        shards = [self.wines[index::4] for index in range(4)]
+
+        def convert(wines):
+            packed = self.snooth.wineify(wines, processes=2, chunk_size=20)
+            return packed.column('code')
+
+        pool = ThreadPool(4)
+        try:
+            for _ in range(3):
+                codes = pool.map(convert, shards)
+                self.assertEqual(codes, [[wine['code'] for wine in wines]
+                                         for wines in shards])
+        finally:
+            pool.close()
+            pool.join()
+
+
+BATCH_WINES = [
+    {'code': 'a', 'price': '12.99', 'snoothrank': 3.5, 'vintage': '2009',
+     'winery': 'Chateau Recougne', 'varietal': 'Red Blend',
+     'region': 'France > Bordeaux > Bordeaux Superieur', 'available': 1},
+    {'code': 'b', 'price': '45.00', 'snoothrank': 4.2, 'vintage': '2010',
+     'winery': 'Catena', 'varietal': 'Malbec',
+     'region': 'Argentina > Mendoza', 'available': 0},
+    {'code': 'c', 'price': '', 'snoothrank': 'n/a', 'vintage': '',
+     'winery': 'Chateau Recougne', 'varietal': 'Red Blend',
+     'region': 'France > Bordeaux', 'available': 1},
+    {'code': 'd', 'price': '8.50', 'snoothrank': 2.9, 'vintage': '2012',
+     'winery': 'Yellow Tail', 'varietal': 'Shiraz',
+     'region': 'Australia', 'available': 1},
+]
+
+
+class WineBatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.batch = WineBatch.from_wines(BATCH_WINES)
+
+    def test_columns(self):
+        self.assertEqual(len(self.batch), 4)
+        self.assertEqual(self.batch['price'].typecode, 'd')
+        self.assertEqual(list(self.batch['vintage']), [2009, 2010, 0, 2012])
+        self.assertEqual(self.batch['winery'].values,
+                         ['Chateau Recougne', 'Catena', 'Yellow Tail'])
+        self.assertEqual(self.batch['region'][1], 'Mendoza')
+        self.assertEqual(self.batch.row(2)['country'], 'France')
+        self.assertTrue(self.batch.row(0)['available'])
+
+    def test_filter(self):
+        cheap = self.batch.filter(max_price=20)
+        self.assertEqual(list(cheap['code']), ['a', 'd'])
+        french = self.batch.filter(country='France', available=True)
+        self.assertEqual(list(french['code']), ['a', 'c'])
+        self.assertEqual(len(self.batch.filter(country='Italy')), 0)
+
+    def test_sort_and_top_k(self):
+        by_price = self.batch.sort('price')
+        self.assertEqual(list(by_price['code']), ['d', 'a', 'b', 'c'])
+        by_price = self.batch.sort('price', reverse=True)
+        self.assertEqual(list(by_price['code']), ['b', 'a', 'd', 'c'])
+        best = self.batch.top_k('snoothrank', 2)
+        self.assertEqual(list(best['code']), ['b', 'a'])
+        cheapest = self.batch.top_k('price', 1, smallest=True)
+        self.assertEqual(cheapest.row(0)['winery'], 'Yellow Tail')
+
+    def test_numpy_and_python_agree(self):
+        import batch
+        wines = [
+            {'code': str(i), 'price': str(i * 7 % 50) if i % 9 else '',
+             'snoothrank': i % 5, 'vintage': 2000 + i % 13,
+             'region': ('France > Bordeaux', 'Italy')[i % 2],
+             'available': i % 3 % 2}
+            for i in range(500)
+        ]
+        big = WineBatch.from_wines(wines)
+
+        def queries():
+            return [
+                list(big.filter(min_price=10, max_price=30, min_rank=2,
+                                available=True, country='France')['code']),
+                big.indices(max_rank=1),
+                big.indices(country='Spain'),
+                list(big.sort('price')['code']),
+                list(big.sort('vintage', reverse=True)['code']),
+                list(big.top_k('price', 20)['code']),
+                list(big.top_k('snoothrank', 20, smallest=True)['code']),
+                list(big.sort('winery')['code']),
+            ]
+
+        installed = batch._numpy()
+        batch.numpy = False
+        try:
+            expected = queries()
+        finally:
+            batch.numpy = None
+        if installed is None:
+            self.skipTest('numpy is not installed')
+        self.assertEqual(queries(), expected)
+
+    def test_wine_search_batch(self):
+        server = StubServer(STUB_WINES)
+        snooth = server.point(SnoothClient(api_key='stub'))
+        try:
+            batch = snooth.wine_search(batch=True)
+            stream = WineBatch.from_wines(snooth.iter_wine_search())
+        finally:
+            snooth.close()
+            server.stop()
+        self.assertTrue(isinstance(batch, WineBatch))
+        self.assertEqual(list(batch['price']), [12.99, 19.99])
+        self.assertEqual(len(stream), 2)
+
+
+class RegionIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.wines = BATCH_WINES + [
+            {'code': 'e', 'region': 'France > Bordeaux > Pauillac'},
+            {'code': 'f', 'region': 'France > Loire'},
+            {'code': 'g', 'region': 'USA > California > Bordeaux'},
+        ]
+        self.index = RegionIndex().add_wines(self.wines)
+
+    def test_interned_nodes(self):
+        first = self.index.node('France > Bordeaux')
+        self.assertEqual(self.index.path(first), ['France', 'Bordeaux'])
+        self.assertEqual(self.index.node(['France', 'Bordeaux']), first)
+        self.assertEqual(self.index.names.count('France'), 1)
+        self.assertEqual(len(self.index), 7)
+
+    def test_wines_under(self):
+        codes = sorted(
+            wine['code'] for wine in
+            self.index.wines_under('France > Bordeaux')
+        )
+        self.assertEqual(codes, ['a', 'c', 'e'])
+        self.assertEqual(self.index.count_under('Bordeaux'), 4)
+        self.assertEqual(self.index.count_under('Italy'), 0)
+        self.assertEqual(self.index.wines_under('Spain > Rioja'), [])
+
+    def test_counts(self):
+        self.assertEqual(self.index.counts(),
+                         {'France': 4, 'Argentina': 1, 'Australia': 1,
+                          'USA': 1})
+        self.assertEqual(
+            self.index.counts('France > Bordeaux'),
+            {'Bordeaux Superieur': 1, 'Pauillac': 1}
+        )
+
+    def test_wine_objects(self):
+        index = RegionIndex().add_wines(
+            Wine(wine) for wine in self.wines
+        )
+        self.assertEqual(index.count_under('France > Bordeaux'), 3)
+        self.assertEqual(index.node('France > Loire'),
+                         index.find('Loire')[0])
+
+
+def store_payload(path):
+    country = query(path).get('c', 'us')
+    stores = {
+        'us': [{'id': 1, 'lat': 41.66, 'lng': -91.53},
+               {'id': 2, 'lat': 41.98, 'lng': -91.66},
+               {'id': 3, 'lat': 40.71, 'lng': -74.0},
+               {'id': 4, 'lat': '', 'lng': ''}],
+        'fr': [{'id': 10, 'lat': 44.84, 'lng': -0.58}],
+    }[country]
+    if StoreIndexTests.closed:
+        stores = stores[1:]
+    if country == 'fr' and StoreIndexTests.closed:
+        return {'meta': {'results': 0, 'errmsg': '', 'status': 1}}
+    return {'meta': {'results': len(stores), 'errmsg': '', 'status': 1},
+            'stores': stores}
+
+
+class StoreIndexTests(unittest.TestCase):
+
+    closed = False
+
+    def setUp(self):
+        StoreIndexTests.closed = False
+        self.server = StubServer(store_payload)
+        self.snooth = self.server.point(SnoothClient(api_key='stub'))
+        self.index = StoreIndex(self.snooth, max_age=60)
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def test_haversine(self):
+        self.assertAlmostEqual(haversine(41.66, -91.53, 41.66, -91.53), 0)
+        distance = haversine(40.71, -74.0, 51.51, -0.13)
+        self.assertTrue(5560 < distance < 5580)
+
+    def test_radius_and_nearest(self):
+        self.assertEqual(self.index.refresh(country='us'), 3)
+        self.assertEqual(self.index.refresh(country='fr'), 1)
+        nearby = self.index.nearby(41.66, -91.53, 50)
+        self.assertEqual([store.id for (distance, store) in nearby], [1, 2])
+        self.assertTrue(nearby[1][0] > 30)
+        nearest = self.index.nearest(41.0, -80.0, k=2)
+        self.assertEqual([store.id for (distance, store) in nearest], [3, 1])
+        self.assertEqual(self.index.nearest(41.66, -91.53, k=10,
+                                            radius=100)[-1][1].id, 2)
+        self.assertEqual(len(self.index.nearest(0, 0, k=10)), 4)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_matches_brute_force(self):
+        index = StoreIndex(cell_size=1)
+        stores = [{'id': i, 'lat': (i * 37) % 178 - 89,
+                   'lng': (i * 73) % 360 - 180} for i in range(300)]
+        index.add_stores(stores)
+        for lat, lng, radius in ((0, 179.5, 800), (85, 10, 1500),
+                                 (-30, -60, 3000), (10, 20, 20000)):
+            expected = sorted(
+                store['id'] for store in stores
+                if haversine(lat, lng, store['lat'], store['lng']) <= radius
+            )
+            found = sorted(store['id'] for (distance, store)
+                           in index.nearby(lat, lng, radius))
+            self.assertEqual(found, expected)
+
+    def test_incremental_refresh(self):
+        self.index.refresh(country='us')
+        self.index.refresh(country='fr')
+        StoreIndexTests.closed = True
+        self.assertEqual(self.index.refresh_stale(), 0)
+        self.index.max_age = 0
+        self.assertEqual(self.index.refresh_stale(), 2)
+        self.assertFalse(1 in self.index)
+        self.assertFalse(10 in self.index)
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.refresh(country='fr'), 0)
+        self.assertEqual(sorted(self.index.areas()),
+                         [('fr', None), ('us', None)])
+
+
+class RecordParserTests(unittest.TestCase):
+
+    def parse(self, payload, size, key='wines'):
+        body = json.dumps(payload).encode('utf-8')
+        parser = RecordParser(key)
+        records = []
+        for start in range(0, len(body), size):
+            records.extend(parser.feed(body[start:start + size]))
+        records.extend(parser.close())
+        return records
+
+    def test_chunk_sizes(self):
+        payload = dict(STUB_WINES, count=12, stores=[{'id': 1}])
+        for size in (1, 3, 16, 4096):
+            self.assertEqual(self.parse(payload, size), STUB_WINES['wines'])
+
+    def test_numbers_split_anywhere(self):
+        body = json.dumps(dict(STUB_WINES, took=1.25e3, rank=-4.5E-2,
+                               count=12)).encode('utf-8')
+        for split in range(1, len(body)):
+            parser = RecordParser('wines')
+            records = parser.feed(body[:split]) + parser.feed(body[split:])
+            records.extend(parser.close())
+            self.assertEqual(records, STUB_WINES['wines'])
+
+    def test_unicode_split_across_chunks(self):
+        payload = {'meta': STUB_WINES['meta'],
+                   'stores': [{'name': u'Caf\u00e9 \u00e0 vin'}]}
+        records = self.parse(payload, 1, key='stores')
+        self.assertEqual(records[0]['name'], u'Caf\u00e9 \u00e0 vin')
+
+    def test_meta_checked_before_records(self):
+        parser = RecordParser('wines')
+        body = json.dumps({'wines': [{'code': 'a'}]})[:-1]
+        self.assertEqual(parser.feed(body.encode('utf-8')), [])
+        records = parser.feed(b', "meta": {"errmsg": "", "results": 1, '
+                              b'"status": 1}}')
+        self.assertEqual(records, [{'code': 'a'}])
+
+    def test_errors(self):
+        error = {'meta': {'results': 0, 'errmsg': 'Invalid API key',
+                          'status': 0}}
+        self.assertRaises(SnoothError, self.parse, error, 5)
+        parser = RecordParser('wines')
+        parser.feed(b'{"meta": {"errmsg": "", "results": 1, "status": 1}, '
+                    b'"wines": [{"code"')
+        self.assertRaises(SnoothError, parser.close)
+        self.assertRaises(SnoothError, RecordParser('wines').feed, b'[]')
+
+
+class JSONDecoderTests(unittest.TestCase):
+
+    def test_stdlib_fallback(self):
+        decoder = JSONDecoder(backend='json')
+        self.assertEqual(decoder.decode(b'{"a": [1, 2]}'), {'a': [1, 2]})
+        stats = decoder.stats()
+        self.assertEqual(stats['backend'], 'json')
+        self.assertEqual(stats['decodes'], 1)
+        self.assertEqual(stats['bytes'], 13)
+        self.assertTrue(stats['seconds'] >= 0)
+
+    def test_stdlib_text_only(self):
+        self.assertEqual(decoders._decode_loads(b'{"a": "\\u00e9"}'),
+                         {'a': u'\u00e9'})
+        self.assertEqual(decoders._decode_loads(u'[1]'), [1])
+
+    def test_custom_loads(self):
+        decoder = JSONDecoder(loads=lambda data: {'size': len(data)})
+        self.assertEqual(decoder.decode(b'abc'), {'size': 3})
+
+    def test_missing_backend(self):
+        self.assertRaises(ImportError, JSONDecoder, backend='nojson')
+
+    def test_client_decoder(self):
+        server = StubServer(STUB_WINES)
+        decoder = JSONDecoder()
+        snooth = server.point(SnoothClient(api_key='stub', decoder=decoder))
+        try:
+            snooth.wine_search()
+            snooth.rate_wine('x')
+        finally:
+            snooth.close()
+            server.stop()
+        self.assertEqual(decoder.decodes, 2)
+
+
+class RecordingObserver(Observer):
+
+    def __init__(self):
+        self.before = []
+        self.after = []
+
+    def before_request(self, event):
+        self.before.append(event.endpoint)
+
+    def after_request(self, event):
+        self.after.append(event)
+
+
+class SnoothMetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(STUB_WINES)
+        self.recorder = RecordingObserver()
+        self.metrics = MetricsObserver()
+        self.snooth = self.server.point(SnoothClient(
+            api_key='stub', cache=ResponseCache(),
+            retry=RetryPolicy(backoff=0.01),
+            observers=[self.recorder, self.metrics]
+        ))
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def test_events(self):
+        self.server.failures = [503]
+        self.snooth.wine_search()
+        self.snooth.wine_search()
+        self.assertRaises(SnoothError, self.snooth.store_detail, 1)
+        self.assertEqual(self.recorder.before,
+                         ['wine_search', 'wine_search', 'store_detail'])
+        first, cached, store = self.recorder.after
+        self.assertEqual(first.retries, 1)
+        self.assertEqual(first.results, 2)
+        self.assertEqual(first.connections, 1)
+        self.assertTrue(first.connect > 0)
+        self.assertTrue(first.ttfb > 0)
+        self.assertTrue(first.bytes > 0)
+        self.assertTrue(first.decode > 0)
+        self.assertTrue(first.total >= first.ttfb)
+        self.assertTrue(cached.cache_hit)
+        self.assertEqual(store.connections, 0)
+        self.assertTrue(isinstance(store.error, SnoothError))
+
+    def test_registry(self):
+        for _ in range(3):
+            self.snooth.wine_detail('chateau-recougne-2009')
+        snapshot = self.metrics.registry.snapshot()['wine_detail']
+        self.assertEqual(snapshot['requests'], 3)
+        self.assertEqual(snapshot['cache_hits'], 2)
+        self.assertEqual(snapshot['ttfb_seconds']['count'], 1)
+        self.assertTrue(snapshot['total_seconds']['p99'] > 0)
+
+    def test_histogram_percentiles(self):
+        histogram = Histogram(max_samples=100)
+        for value in range(1, 201):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 200)
+        self.assertEqual(histogram.percentile(50), 151)
+        self.assertEqual(histogram.percentile(99), 199)
+
+    def test_pages_observed(self):
+        server = StubServer(paged_payload)
+        snooth = server.point(SnoothClient(api_key='stub',
+                                           observers=[self.recorder]))
+        try:
+            wines = list(snooth.iter_wine_search(count=10, prefetch=True))
+            actions = list(snooth.iter_user_activity(count=20))
+        finally:
+            snooth.close()
+            server.stop()
+        self.assertEqual(len(wines), 23)
+        self.assertEqual(len(actions), 23)
+        self.assertEqual(self.recorder.before, ['wine_search'] * 3 +
+                         ['user_activity'] * 2)
+        self.assertEqual([event.results for event in self.recorder.after],
+                         [10, 10, 3, 20, 3])
+        self.assertTrue(all(event.bytes > 0
+                            for event in self.recorder.after))
+
+    def test_stream_observed(self):
+        wines = self.snooth.wine_search(stream=True)
+        self.assertEqual(self.recorder.after, [])
+        self.assertEqual(len(list(wines)), 2)
+        event, = self.recorder.after
+        self.assertEqual(event.results, 2)
+        self.assertTrue(event.bytes > 0)
+        self.assertTrue(event.decode > 0)
+        self.assertTrue(event.total >= event.ttfb)
+        wines = self.snooth.wine_search(stream=True, wineify=True)
+        next(wines)
+        wines.close()
+        self.assertEqual(self.recorder.after[-1].results, 1)
+
+    def test_no_observers(self):
+        self.snooth.observers = []
+        self.snooth.wine_search()
+        self.assertEqual(self.recorder.after, [])
+
+
+class SnoothStreamTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(dict(STUB_WINES, stores=[{'id': 3}],
+                                      actions=[{'id': 4}]))
+        self.snooth = self.server.point(SnoothClient(api_key='stub'))
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def test_wine_search_stream(self):
+        wines = self.snooth.wine_search(stream=True)
+        self.assertFalse(isinstance(wines, list))
+        self.assertEqual(list(wines), STUB_WINES['wines'])
+        wines = list(self.snooth.wine_search(stream=True, wineify=True))
+        self.assertTrue(isinstance(wines[0], Wine))
+        batch = self.snooth.my_wines(stream=True, batch=True)
+        self.assertEqual(len(batch), 2)
+
+    def test_store_search_and_activity_stream(self):
+        stores = list(self.snooth.store_search(stream=True, storeify=True))
+        self.assertEqual(stores[0].id, 3)
+        actions = list(self.snooth.user_activity(stream=True))
+        self.assertEqual(actions, [{'id': 4}])
+
+    def test_stream_error(self):
+        self.server.payload = {
+            'meta': {'results': 0, 'errmsg': 'Invalid API key',
+                     'status': 0}
+        }
+        wines = self.snooth.wine_search(stream=True)
+        self.assertRaises(SnoothError, list, wines)
+
+
+class FakeSnoothServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeSnoothServer(catalog_size=25, store_count=3,
+                                       padding=10).start()
+        self.snooth = self.server.point(SnoothClient(api_key='fake'))
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def test_read_endpoints(self):
+        wines = self.snooth.wine_search(count=10, page=3, wineify=True)
+        self.assertEqual([wine.code for wine in wines],
+                         ['wine-%d' % i for i in range(21, 26)])
+        self.assertEqual(wines[0].country, 'Italy')
+        self.assertEqual(len(wines[0].code), 7)
+        self.assertEqual(self.snooth.wine_detail('wine-4')['code'], 'wine-4')
+        self.assertEqual(len(self.snooth.my_wines(count=5)), 5)
+        self.assertEqual(self.snooth.winery_detail('winery-1')['id'],
+                         'winery-1')
+        stores = self.snooth.store_search(storeify=True)
+        self.assertEqual(len(stores), 3)
+        self.assertEqual(self.snooth.store_detail(2)['id'], 2)
+        self.assertEqual(len(list(self.snooth.iter_user_activity())), 25)
+
+    def test_write_endpoints(self):
+        for response in (self.snooth.rate_wine('wine-1', rating=4),
+                         self.snooth.wishlist('wine-1'),
+                         self.snooth.create_account('a@b.c', 'me', 'pw')):
+            self.assertEqual(response['meta']['status'], 1)
+        self.assertEqual(self.server.request_count, 3)
+
+    def test_injected_faults(self):
+        self.server.error_rate = 1
+        self.assertRaises(HTTPError, self.snooth.wine_search)
+        self.server.error_rate = 0
+        self.server.snooth_error_rate = 1
+        self.assertRaises(SnoothError, self.snooth.wine_detail, 'wine-1')
+        self.server.snooth_error_rate = 0
+        self.server.latency = 0.1
+        started = time.time()
+        self.snooth.store_detail(1)
+        self.assertTrue(time.time() - started >= 0.1)
+
+
+class CatalogSyncTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeSnoothServer(catalog_size=25).start()
+        self.snooth = self.server.point(SnoothClient(api_key='fake'))
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'catalog.jsonl')
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def sync(self):
+        return CatalogSync(self.snooth, self.path, count=10, workers=4,
+                           country='fr').run()
+
+    def test_full_then_incremental(self):
+        stats = self.sync()
+        self.assertEqual((stats['pages'], stats['seen'], stats['updated']),
+                         (3, 25, 25))
+        self.assertEqual(self.server.request_count, 28)
+        stats = self.sync()
+        self.assertEqual((stats['unchanged'], stats['updated']), (25, 0))
+        self.assertEqual(self.server.request_count, 31)
+        self.server.catalog_size = 27
+        stats = self.sync()
+        self.assertEqual((stats['unchanged'], stats['updated']), (25, 2))
+        with CatalogSnapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 27)
+            self.assertEqual(snapshot.get('wine-26')['code'], 'wine-26')
+            snapshot.compact()
+            self.assertEqual(snapshot.get('wine-3')['name'], 'Wine 3')
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+    def test_resume_from_checkpoint(self):
+        wine_search = self.snooth.wine_search
+
+        def crash(**kwargs):
+            if kwargs['first_result'] == 21:
+                raise ConnectionError('crashed')
+            return wine_search(**kwargs)
+
+        self.snooth.wine_search = crash
+        self.assertRaises(ConnectionError, self.sync)
+        self.assertTrue(os.path.exists(self.path + '.checkpoint'))
+        self.snooth.wine_search = wine_search
+        stats = self.sync()
+        self.assertEqual((stats['pages'], stats['updated']), (1, 5))
+        with CatalogSnapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 25)
+
+    def test_torn_line_dropped(self):
+        self.sync()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as snapshot_file:
+            snapshot_file.write(b'{"code": "wine-99", "fing')
+        with CatalogSnapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 25)
+        self.assertEqual(os.path.getsize(self.path), size)
+
+
+class WriteQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(STUB_WINES)
+        self.snooth = self.server.point(
+            SnoothClient(api_key='stub', username='me', password='pw')
+        )
+        self.directory = tempfile.mkdtemp()
+        self.spill = os.path.join(self.directory, 'writes.jsonl')
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_coalesces_pending_writes(self):
+        self.server.delay = 0.2
+        queue = WriteQueue(self.snooth, workers=1)
+        queue.rate('catena-malbec-2010', rating=1)
+        time.sleep(0.05)
+        queue.rate('chateau-recougne-2009', rating=2)
+        queue.rate('chateau-recougne-2009', rating=5, review='great')
+        Wine(STUB_WINES['wines'][0]).list(queue=queue)
+        self.assertTrue(queue.flush(timeout=5))
+        self.assertEqual(queue.sent, 3)
+        self.assertEqual(len(self.server.requests), 3)
+        rating = query(self.server.requests[1])
+        self.assertEqual((rating['r'], rating['b'], rating['u']),
+                         ('5', 'great', 'me'))
+        self.assertTrue(queue.drain())
+        self.assertRaises(SnoothError, queue.wishlist, 'catena-malbec-2010')
+
+    def test_retries_transient_failures(self):
+        self.server.failures = [503, 503]
+        queue = WriteQueue(self.snooth, retry=RetryPolicy(backoff=0.01))
+        queue.rate('catena-malbec-2010', rating=4)
+        queue.flush()
+        self.assertEqual((queue.sent, len(self.server.requests)), (1, 3))
+        self.server.payload = {'meta': {'results': 0, 'status': 0,
+                                        'errmsg': 'Invalid rating'}}
+        queue.rate('catena-malbec-2010', rating=11)
+        queue.drain()
+        self.assertEqual(len(queue.failed), 1)
+        self.assertTrue(isinstance(queue.failed[0][1], SnoothError))
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_spill_survives_crash(self):
+        crashed = WriteQueue(self.snooth, workers=0, spill=self.spill)
+        crashed.rate('catena-malbec-2010', rating=3)
+        crashed.rate('catena-malbec-2010', review='ok')
+        crashed.wishlist('chateau-recougne-2009', username='you')
+        self.assertEqual(os.stat(self.spill).st_mode & 0o777, 0o600)
+        self.assertEqual(len(self.server.requests), 0)
+        with WriteQueue(self.snooth, spill=self.spill) as queue:
+            self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.sent, 2)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(os.path.getsize(self.spill), 0)
+        self.assertEqual(len(WriteQueue(self.snooth, spill=self.spill)), 0)
+
+    def test_journal_group_commit(self):
+        queue = WriteQueue(self.snooth, workers=0, spill=self.spill)
+        fsync = os.fsync
+        syncs = []
+
+        def slow_fsync(descriptor):
+            syncs.append(descriptor)
+            time.sleep(0.02)
+            fsync(descriptor)
+
+        def rate(wine_id):
+            queue.rate(wine_id, rating=4)
+            with io.open(self.spill, 'rb') as journal:
+                return ('"wine_id": "%s"' % wine_id).encode() \
+                    in journal.read()
+
+        os.fsync = slow_fsync
+        pool = ThreadPool(20)
+        try:
+            on_disk = pool.map(rate, ['wine-%d' % i for i in range(20)])
+        finally:
+            os.fsync = fsync
+            pool.terminate()
+            pool.join()
+        self.assertTrue(all(on_disk))
+        self.assertTrue(len(syncs) < 20)
+        self.assertEqual(len(queue), 20)
+
+
+class SnoothTransportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(STUB_WINES)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connection_reused_across_endpoints(self):
+        with self.server.point(SnoothClient(api_key='stub')) as snooth:
+            snooth.wine_search()
+            snooth.wine_detail('chateau-recougne-2009')
+            snooth.rate_wine('chateau-recougne-2009', rating=5)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_close_releases_pool(self):
+        snooth = self.server.point(SnoothClient(api_key='stub'))
+        first = snooth.session
+        snooth.close()
+        self.assertTrue(snooth._session is None)
+        self.assertFalse(snooth.session is first)
+        snooth.close()
+
+    def test_keep_alive_disabled(self):
+        snooth = self.server.point(
+            SnoothClient(api_key='stub', keep_alive=False)
+        )
+        snooth.wine_search()
+        snooth.wine_search()
+        snooth.close()
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_pool_settings(self):
+        snooth = SnoothClient(api_key='stub', pool_maxsize=4,
+                              pool_block=True)
+        adapter = snooth.session.get_adapter('https://api.snooth.com/')
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertTrue(adapter._pool_block)
+        snooth.close()
+
+
+class CassetteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(STUB_WINES)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snooth.jsonl.gz')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def record(self):
+        snooth = self.server.point(SnoothClient(
+            api_key='stub', username='me', password='secret',
+            cassette=Cassette(self.path, mode='record')
+        ))
+        with snooth:
+            recorded = snooth.wine_search(q='malbec', count=5)
+            list(snooth.my_wines(stream=True))
+            snooth.rate_wine('catena-malbec-2010', rating=4)
+        return recorded
+
+    def test_record_and_replay(self):
+        recorded = self.record()
+        self.assertEqual(len(self.server.requests), 3)
+        replay = SnoothClient(api_key='other', username='you',
+                              password='other',
+                              cassette=Cassette(self.path, mode='replay'))
+        self.assertEqual(replay.wine_search(q='malbec', count=5), recorded)
+        self.assertEqual(len(list(replay.my_wines(stream=True))), 2)
+        replay.rate_wine('catena-malbec-2010', rating=4)
+        self.assertEqual(replay.cassette.hits, 3)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertRaises(CassetteMissError, replay.wine_search, q='zin')
+
+    def test_credentials_scrubbed(self):
+        self.record()
+        with gzip.open(self.path, 'rb') as cassette_file:
+            content = cassette_file.read().decode('utf-8')
+        self.assertFalse('secret' in content)
+        self.assertFalse('akey' in content)
+        self.assertTrue('malbec' in content)
+
+    def test_auto_records_misses(self):
+        cassette = Cassette(mode='auto')
+        snooth = self.server.point(SnoothClient(api_key='stub',
+                                                cassette=cassette))
+        snooth.wine_search()
+        snooth.wine_search()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual((cassette.hits, cassette.misses), (1, 1))
+
+    def test_server_errors_not_recorded(self):
+        cassette = Cassette(mode='auto')
+        snooth = self.server.point(SnoothClient(api_key='stub',
+                                                cassette=cassette))
+        self.server.status = 503
+        self.assertRaises(HTTPError, snooth.wine_search)
+        self.assertEqual(len(cassette), 0)
+
+
+class LazyImportTests(unittest.TestCase):
+
+    def run_python(self, code, **env):
+        environ = dict(os.environ, **env)
+        environ.pop('API_KEY', None)
+        environ.update(env)
+        process = subprocess.Popen(
+            [sys.executable, '-c', code], env=environ,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        return stdout.decode('utf-8').strip(), stderr
+
+    def test_import_is_light(self):
+        stdout, stderr = self.run_python(
+            'import sys, client\n'
+            'print(sorted(name for name in ("requests", "sqlite3", '
+            '"multiprocessing.pool") if name in sys.modules))'
+        )
+        self.assertEqual(stdout, '[]')
+        self.assertEqual(stderr, b'')
+
+    def test_api_key_resolved_at_construction(self):
+        code = ('import os, client\n'
+                'os.environ["API_KEY"] = "late"\n'
+                'print(client.SnoothClient().api_key)')
+        self.assertEqual(self.run_python(code)[0], 'late')
+        code = 'import client\nprint(client.SnoothClient().api_key)'
+        self.assertEqual(self.run_python(code, API_KEY='env')[0], 'env')
+
+    def test_http_stack_loaded_on_first_request(self):
+        server = StubServer(STUB_WINES)
+        try:
+            snooth = server.point(SnoothClient(api_key='stub'))
+            self.assertEqual(len(snooth.wine_search()), 2)
+            self.assertEqual(snooth.transient_errors(),
+                             (ConnectionError, Timeout))
+            snooth.close()
+        finally:
+            server.stop()
+
+
+class SnoothUserTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(STUB_WINES)
+        self.snooth = self.server.point(
+            SnoothClient(api_key='mine', username='owner', password='pw')
+        )
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def test_api_key_argument_used(self):
+        self.assertEqual(self.snooth.basic_params()['akey'], 'mine')
+
+    def test_users_share_transport(self):
+        users = [self.snooth.as_user('user%d' % i, 'pw%d' % i)
+                 for i in range(8)]
+        self.assertTrue(users[0].session is self.snooth.session)
+        pool = ThreadPool(4)
+        pool.map(lambda user: user.my_wines(), users)
+        pool.close()
+        self.assertEqual(sorted(query(path)['u'] for path
+                                in self.server.requests),
+                         sorted('user%d' % i for i in range(8)))
+        self.assertTrue(len(self.server.connections) <= 4)
+        users[0].close()
+        self.assertFalse(self.snooth._session is None)
+        self.assertEqual(self.snooth.username, 'owner')
+
+    def test_models_use_owning_client(self):
+        user = self.snooth.as_user('me', 'secret')
+        wine = user.my_wines(wineify=True)[0]
+        self.assertTrue(wine.client is user)
+        self.assertEqual(wine.detail()['code'], 'chateau-recougne-2009')
+        wine.rate(rating=4)
+        wine.list()
+        rating = query(self.server.requests[-2])
+        self.assertEqual((rating['u'], rating['p'], rating['akey']),
+                         ('me', 'secret', 'mine'))
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_vendors_use_owning_client(self):
+        with FakeSnoothServer(store_count=2) as server:
+            snooth = server.point(SnoothClient(api_key='fake'))
+            store = snooth.store_search(storeify=True)[1]
+            self.assertTrue(store.client is snooth)
+            self.assertEqual(store.detail()['id'], 1)
+            winery = snooth.winery_detail('winery-2', wineryify=True)
+            self.assertTrue(winery.client is snooth)
+            snooth.close()
+
+
+def query(path):
+    return dict(
+        (key, values[0]) for (key, values)
+        in parse_qs(urlparse(path).query).items()
+    )
+
+
+def wine_detail_payload(path):
+    wine_id = query(path)['id']
+    if wine_id.startswith('bad'):
+        return {'meta': {'results': 0, 'errmsg': 'No such wine',
+                         'status': 0}}
+    return {'meta': {'results': 1, 'errmsg': '', 'status': 1},
+            'wines': [{'code': wine_id}]}
+
+
+class SnoothBatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(wine_detail_payload)
+        self.snooth = self.server.point(SnoothClient(api_key='stub'))
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def test_wine_details_ordered(self):
+        wine_ids = ['wine-%d' % i for i in range(25)]
+        wines, errors = self.snooth.wine_details(wine_ids, workers=4)
+        self.assertEqual([wine['code'] for wine in wines], wine_ids)
+        self.assertEqual(errors, {})
+
+    def test_wine_details_collects_errors(self):
+        wines, errors = self.snooth.wine_details(
+            ['wine-1', 'bad-2', 'wine-3'], photos=True
+        )
+        self.assertEqual(wines[0]['code'], 'wine-1')
+        self.assertTrue(wines[1] is None)
+        self.assertEqual(wines[2]['code'], 'wine-3')
+        self.assertTrue(isinstance(errors['bad-2'], SnoothError))
+        self.assertTrue('photos=1' in self.server.requests[-1])
+
+    def test_iter_wine_details(self):
+        wine_ids = ['wine-1', 'bad-2', 'wine-3', 'wine-4']
+        results = list(self.snooth.iter_wine_details(wine_ids, workers=2))
+        self.assertEqual(sorted(r[0] for r in results), sorted(wine_ids))
+        for wine_id, wine, error in results:
+            self.assertEqual(error is None, not wine_id.startswith('bad'))
+
+    def test_wine_details_empty(self):
+        self.assertEqual(self.snooth.wine_details([]), ([], {}))
+
+    def test_wine_details_bad_workers(self):
+        self.assertRaises(SnoothError, self.snooth.wine_details, ['x'],
+                          workers=0)
+        self.assertRaises(SnoothError, self.snooth.iter_wine_details, ['x'],
+                          workers=0)
+
+
+def paged_payload(path, total=23):
+    params = query(path)
+    first, count = int(params['f']), int(params['n'])
+    codes = ['wine-%d' % i for i in range(first, min(first + count,
+                                                     total + 1))]
+    return {
+        'meta': {'results': total, 'returned': len(codes), 'errmsg': '',
+                 'status': 1},
+        'wines': [{'code': code} for code in codes],
+        'actions': [{'id': code} for code in codes]
+    }
+
+
+class SnoothPaginationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(paged_payload)
+        self.snooth = self.server.point(SnoothClient(api_key='stub'))
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def test_iter_wine_search(self):
+        wines = list(self.snooth.iter_wine_search(count=10))
+        self.assertEqual([wine['code'] for wine in wines],
+                         ['wine-%d' % i for i in range(1, 24)])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_iter_wine_search_prefetch_wineify(self):
+        wines = list(self.snooth.iter_wine_search(
+            count=5, page=2, wineify=True, prefetch=True
+        ))
+        self.assertEqual(len(wines), 18)
+        self.assertTrue(isinstance(wines[0], Wine))
+        self.assertEqual(wines[0].code, 'wine-6')
+
+    def test_iter_wine_search_is_lazy(self):
+        wines = self.snooth.iter_wine_search(count=10)
+        next(wines)
+        self.assertEqual(len(self.server.requests), 1)
+        wines.close()
+
+    def test_iter_user_activity(self):
+        actions = list(self.snooth.iter_user_activity(count=20,
+                                                      prefetch=True))
+        self.assertEqual(len(actions), 23)
+        self.assertEqual(actions[-1]['id'], 'wine-23')
+
+
+class ResponseCacheTests(unittest.TestCase):
+
+    def test_key_excludes_credentials(self):
+        cache = ResponseCache()
+        first = cache.key('wine_detail', {'id': 'x', 'akey': 'a', 'u': 'me',
+                                          'p': 'secret', 'lat': None})
+        second = cache.key('wine_detail', {'id': 'x', 'akey': 'b'})
+        self.assertEqual(first, second)
+        self.assertFalse('secret' in repr(first))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertTrue(cache.get('b') is None)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl_per_endpoint(self):
+        cache = ResponseCache(ttl=60, ttls={'wine_search': 0})
+        search = cache.key('wine_search', {'q': 'wine'})
+        detail = cache.key('wine_detail', {'id': 'x'})
+        cache.set(search, {})
+        cache.set(detail, {})
+        self.assertTrue(cache.get(search) is None)
+        self.assertEqual(cache.get(detail), {})
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_invalidate(self):
+        cache = ResponseCache()
+        cache.set(cache.key('store_detail', {'id': 1}), {})
+        cache.set(cache.key('store_detail', {'id': 2}), {})
+        self.assertEqual(cache.invalidate('store_detail', id=1), 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_peek_serves_stale(self):
+        cache = ResponseCache(ttl=0.05)
+        cache.set('a', 1)
+        value, remaining = cache.peek('a')
+        self.assertTrue(0 < remaining <= 0.05)
+        time.sleep(0.1)
+        self.assertTrue(cache.peek('a') is None)
+        value, remaining = cache.peek('a', stale=1)
+        self.assertEqual(value, 1)
+        self.assertTrue(remaining < 0)
+        self.assertTrue(cache.peek('a', stale=0.01) is None)
+
+
+class SQLiteCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snooth.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_between_instances(self):
+        writer = SQLiteCache(self.path)
+        key = writer.key('wine_detail', {'id': 'x', 'p': 'secret'})
+        writer.set(key, {'wines': [{'code': 'x'}]})
+        reader = SQLiteCache(self.path)
+        self.assertEqual(reader.get(key), {'wines': [{'code': 'x'}]})
+        self.assertEqual(reader.hits, 1)
+        writer.close()
+        reader.close()
+
+    def test_ttl_and_eviction(self):
+        cache = SQLiteCache(self.path, maxsize=2, prune_interval=1,
+                            ttls={'store_detail': 0})
+        expired = cache.key('store_detail', {'id': 1})
+        cache.set(expired, {})
+        self.assertTrue(cache.get(expired) is None)
+        for wine_id in 'abc':
+            cache.set(cache.key('wine_detail', {'id': wine_id}), {})
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(cache.get(cache.key('wine_detail', {'id': 'a'}))
+                        is None)
+
+    def test_invalidate_wine(self):
+        cache = SQLiteCache(self.path)
+        cache.set(cache.key('wine_detail', {'id': 'x'}), {})
+        cache.set(cache.key('wine_search', {'q': 'y'}),
+                  {'wines': [{'code': 'x'}]})
+        cache.set(cache.key('winery_detail', {'id': 'x'}), {})
+        self.assertEqual(cache.invalidate_wine('x'), 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_client_uses_disk_cache(self):
+        server = StubServer(STUB_WINES)
+        try:
+            for _ in range(2):
+                snooth = server.point(SnoothClient(
+                    api_key='stub', cache=SQLiteCache(self.path)
+                ))
+                snooth.wine_detail('chateau-recougne-2009')
+                snooth.close()
+            self.assertEqual(len(server.requests), 1)
+        finally:
+            server.stop()
+
+
+class SnoothCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(STUB_WINES)
+        self.cache = ResponseCache()
+        self.snooth = self.server.point(
+            SnoothClient(api_key='stub', cache=self.cache)
+        )
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def test_read_endpoints_cached(self):
+        for _ in range(3):
+            self.snooth.wine_search(q='malbec')
+            self.snooth.wine_detail('chateau-recougne-2009')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.cache.hits, 4)
+
+    def test_write_invalidates_wine(self):
+        self.snooth.wine_search(q='malbec')
+        self.snooth.wine_detail('chateau-recougne-2009')
+        self.snooth.wine_detail('catena-malbec-2010')
+        self.snooth.rate_wine('chateau-recougne-2009', rating=4)
+        self.assertEqual(len(self.cache), 1)
+        self.snooth.wishlist('catena-malbec-2010')
+        self.assertEqual(len(self.cache), 0)
+
+    def test_uncached_without_cache(self):
+        self.snooth.cache = None
+        self.snooth.wine_search()
+        self.snooth.wine_search()
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class SnoothRevalidateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(wine_detail_payload)
+        self.cache = ResponseCache(ttl=0.1, ttls={'wine_search': 60})
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def client(self, **kwargs):
+        self.revalidator = Revalidator(**kwargs)
+        self.snooth = self.server.point(SnoothClient(
+            api_key='stub', cache=self.cache, revalidator=self.revalidator
+        ))
+        return self.snooth
+
+    def test_serves_stale_while_refreshing(self):
+        snooth = self.client(stale=5, min_hits=100)
+        first = snooth.wine_detail('a')
+        time.sleep(0.15)
+        self.server.delay = 0.3
+        started = time.time()
+        self.assertTrue(snooth.wine_detail('a') is first)
+        self.assertTrue(time.time() - started < 0.2)
+        self.assertTrue(self.revalidator.wait(timeout=5))
+        self.assertEqual(self.revalidator.refreshes, 1)
+        self.assertFalse(snooth.wine_detail('a') is first)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_hot_entries_refreshed_ahead(self):
+        snooth = self.client(ahead=1, min_hits=3)
+        snooth.wine_detail('a')
+        snooth.wine_detail('a')
+        self.revalidator.wait()
+        self.assertEqual(len(self.server.requests), 1)
+        snooth.wine_detail('a')
+        self.revalidator.wait()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_refresh_cap_and_bounds(self):
+        snooth = self.client(stale=0.2, max_refreshes=1)
+        snooth.wine_detail('a')
+        snooth.wine_detail('b')
+        time.sleep(0.15)
+        self.server.delay = 0.2
+        snooth.wine_detail('a')
+        snooth.wine_detail('b')
+        self.assertEqual(self.revalidator.stats()['skipped'], 1)
+        self.revalidator.wait()
+        self.server.delay = 0
+        time.sleep(0.3)
+        snooth.wine_detail('b')
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.revalidator.refreshes, 1)
+
+    def test_other_endpoints_unaffected(self):
+        snooth = self.client(endpoints=('store_detail',))
+        snooth.wine_detail('a')
+        time.sleep(0.15)
+        snooth.wine_detail('a')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.revalidator.refreshes, 0)
+
+
+class SnoothCoalesceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(STUB_WINES)
+        self.server.delay = 0.2
+        self.snooth = self.server.point(
+            SnoothClient(api_key='stub', coalesce=True)
+        )
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def run_threads(self, fn, count=10):
+        results = []
+
+        def target():
+            try:
+                results.append(fn())
+            except Exception as error:
+                results.append(error)
+
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_requests_coalesced(self):
+        results = self.run_threads(
+            lambda: self.snooth.wine_detail('chateau-recougne-2009')
+        )
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(results), 10)
+        for result in results:
+            self.assertTrue(result is results[0])
+        self.assertEqual(len(self.snooth.inflight), 0)
+
+    def test_error_shared(self):
+        self.server.payload = {
+            'meta': {'results': 0, 'errmsg': 'Invalid API key',
+                     'status': 0}
+        }
+        results = self.run_threads(lambda: self.snooth.store_search('us'))
+        self.assertEqual(len(self.server.requests), 1)
+        for result in results:
+            self.assertTrue(isinstance(result, SnoothError))
+
+    def test_different_params_not_coalesced(self):
+        self.run_threads(lambda: self.snooth.store_search('us'), count=3)
+        self.run_threads(lambda: self.snooth.store_search('fr'), count=3)
+        self.assertEqual(len(self.server.requests), 2)
+
+
+class RateLimiterTests(unittest.TestCase):
+
+    def test_fail_fast(self):
+        limiter = RateLimiter(rate=1, burst=3, mode='fail')
+        for _ in range(3):
+            self.assertEqual(limiter.reserve(), 0)
+        self.assertEqual(limiter.remaining()['second'], 0)
+        self.assertRaises(RateLimitExceeded, limiter.reserve)
+
+    def test_queue_max_wait(self):
+        limiter = RateLimiter(rate=10, burst=1, mode='queue', max_wait=0.25)
+        delays = [limiter.reserve() for _ in range(3)]
+        self.assertEqual(delays[0], 0)
+        self.assertTrue(0 < delays[1] < delays[2] <= 0.25)
+        self.assertRaises(RateLimitExceeded, limiter.reserve)
+
+    def test_daily_quota(self):
+        limiter = RateLimiter(daily=2)
+        limiter.acquire()
+        self.assertEqual(limiter.remaining(), {'second': None, 'daily': 1})
+        limiter.acquire()
+        self.assertRaises(RateLimitExceeded, limiter.acquire)
+
+    def test_bad_mode(self):
+        self.assertRaises(ValueError, RateLimiter, rate=1, mode='drop')
+
+    def test_client_paced(self):
+        server = StubServer(STUB_WINES)
+        limiter = RateLimiter(rate=20, burst=1)
+        snooth = server.point(SnoothClient(api_key='stub', limiter=limiter))
+        started = time.time()
+        try:
+            for _ in range(5):
+                snooth.wine_search()
+        finally:
+            snooth.close()
+            server.stop()
+        self.assertTrue(time.time() - started >= 0.19)
+
+
+class SnoothRetryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(STUB_WINES)
+        self.snooth = self.server.point(SnoothClient(
+            api_key='stub', retry=RetryPolicy(retries=3, backoff=0.01)
+        ))
+
+    def tearDown(self):
+        self.snooth.close()
+        self.server.stop()
+
+    def test_get_retried(self):
+        self.server.failures = [503, 429]
+        response = self.snooth.wine_search()
+        self.assertEqual(len(response), 2)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retries_exhausted(self):
+        self.server.failures = [500] * 5
+        self.assertRaises(HTTPError, self.snooth.wine_search)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_client_errors_not_retried(self):
+        self.server.failures = [404]
+        self.assertRaises(HTTPError, self.snooth.wine_search)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_post_not_retried(self):
+        self.server.failures = [503]
+        self.assertRaises(HTTPError, self.snooth.wishlist, 'x')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_deadline_spans_attempts(self):
+        self.snooth.retry = RetryPolicy(retries=10, backoff=0.2,
+                                        jitter=False, deadline=0.5)
+        self.server.failures = [503] * 10
+        started = time.time()
+        self.assertRaises(HTTPError, self.snooth.wine_search)
+        self.assertTrue(time.time() - started < 0.6)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_connection_errors_open_circuit(self):
+        snooth = SnoothClient(
+            api_key='stub',
+            retry=RetryPolicy(retries=1, backoff=0.01),
+            breaker=CircuitBreaker(failures=2, reset_timeout=0.2)
+        )
+        snooth.WINE_SEARCH_URL = self.server.url + '/wines/'
+        self.server.stop()
+        self.assertRaises(ConnectionError, snooth.wine_search)
+        self.assertEqual(snooth.breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpenError, snooth.wine_search)
+        snooth.close()
+        self.server = StubServer(STUB_WINES)
+
+    def test_circuit_half_open_recovers(self):
+        breaker = CircuitBreaker(failures=1, reset_timeout=0.1)
+        self.snooth.retry = None
+        self.snooth.breaker = breaker
+        self.server.failures = [502]
+        self.assertRaises(HTTPError, self.snooth.wine_search)
+        self.assertRaises(CircuitOpenError, self.snooth.wine_search)
+        time.sleep(0.1)
+        self.snooth.wine_search()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_client_error_keeps_circuit_closed(self):
+        self.snooth.breaker = CircuitBreaker(failures=1)
+        self.server.failures = [404]
+        self.assertRaises(HTTPError, self.snooth.wine_search)
+        self.assertEqual(self.snooth.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_local_errors_leave_circuit_alone(self):
+        breaker = CircuitBreaker(failures=3, reset_timeout=0.1)
+        snooth = SnoothClient(
+            api_key='stub', breaker=breaker,
+            limiter=RateLimiter(rate=1, burst=1, mode='fail')
+        )
+        snooth.WINE_SEARCH_URL = self.server.url + '/wines/'
+        self.server.stop()
+        breaker.failure()
+        breaker.failure()
+        self.assertRaises(ConnectionError, snooth.wine_search)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        time.sleep(0.1)
+        self.assertRaises(RateLimitExceeded, snooth.wine_search)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        snooth.limiter = None
+        self.server = StubServer(STUB_WINES)
+        snooth.WINE_SEARCH_URL = self.server.url + '/wines/'
+        snooth.wine_search()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        snooth.close()
+
+    def test_limiter_rejection_keeps_failure_count(self):
+        breaker = CircuitBreaker(failures=3)
+        snooth = SnoothClient(
+            api_key='stub', breaker=breaker,
+            limiter=RateLimiter(rate=1, burst=2, mode='fail')
+        )
+        snooth.WINE_SEARCH_URL = self.server.url + '/wines/'
+        self.server.stop()
+        self.assertRaises(ConnectionError, snooth.wine_search)
+        self.assertRaises(ConnectionError, snooth.wine_search)
+        self.assertRaises(RateLimitExceeded, snooth.wine_search)
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        snooth.close()
+        self.server = StubServer(STUB_WINES)
+
+
+@unittest.skipIf(AsyncSnoothClient is None, 'aiohttp is not installed')
+class AsyncSnoothClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(STUB_WINES)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.snooth = self.server.point(AsyncSnoothClient(api_key='stub'))
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.snooth.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self.server.stop()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_wine_search_wineify(self):
+        response = self.run_async(self.snooth.wine_search(wineify=True))
+        self.assertEqual(len(response), 2)
+        for wine in response:
+            self.assertTrue(isinstance(wine, Wine))
+
+    def test_store_search_params_shared(self):
+        self.run_async(self.snooth.store_search(country='us', zipcode='1'))
+        path = self.server.requests[-1]
+        self.assertTrue(path.startswith('/stores/?'))
+        self.assertTrue('c=us' in path)
+        self.assertFalse('lat=' in path)
+
+    def test_fan_out_shares_pool(self):
+        lookups = [
+            self.snooth.wine_detail('chateau-recougne-2009')
+            for _ in range(20)
+        ]
+        results = self.run_async(asyncio.gather(*lookups))
+        self.assertEqual(len(results), 20)
+        self.assertTrue(len(self.server.connections) <= 10)
+
+    def test_coalesce(self):
+        snooth = self.server.point(
+            AsyncSnoothClient(api_key='stub', coalesce=True)
+        )
+        self.server.delay = 0.1
+        lookups = [snooth.wine_detail('chateau-recougne-2009')
+                   for _ in range(10)]
+        results = self.run_async(asyncio.gather(*lookups))
+        self.run_async(snooth.close())
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len(snooth.inflight), 0)
+
+    def collect(self, iterator):
+        """Items of an async iterator, read one at a time on the loop."""
+        items = []
+        while True:
+            try:
+                items.append(self.run_async(iterator.__anext__()))
+            except StopAsyncIteration:
+                return items
+
+    def test_coalesce_leader_cancelled(self):
+        inflight = AsyncSingleFlight()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return asyncio.sleep(0.1, 'wine')
+
+        leader = self.loop.create_task(
+            asyncio.wait_for(inflight.do('key', fetch), 0.01)
+        )
+        while not calls:
+            self.run_async(asyncio.sleep(0))
+        follower = self.loop.create_task(inflight.do('key', fetch))
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_async(leader)
+        self.assertEqual(self.run_async(asyncio.wait_for(follower, 1)),
+                         'wine')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(inflight), 0)
+
+    def test_iter_wine_search(self):
+        server = StubServer(paged_payload)
+        snooth = server.point(AsyncSnoothClient(api_key='stub'))
+        try:
+            wines = self.collect(snooth.iter_wine_search(count=10))
+            self.assertEqual([wine['code'] for wine in wines],
+                             ['wine-%d' % i for i in range(1, 24)])
+            self.assertEqual(len(server.requests), 3)
+            wines = self.collect(snooth.iter_wine_search(
+                count=5, page=2, wineify=True, prefetch=True
+            ))
+            self.assertEqual(len(wines), 18)
+            self.assertEqual(wines[0].code, 'wine-6')
+        finally:
+            self.run_async(snooth.close())
+            server.stop()
+
+    def test_iter_user_activity(self):
+        server = StubServer(paged_payload)
+        snooth = server.point(AsyncSnoothClient(api_key='stub'))
+        try:
+            actions = self.collect(
+                snooth.iter_user_activity(count=20, prefetch=True)
+            )
+        finally:
+            self.run_async(snooth.close())
+            server.stop()
+        self.assertEqual(len(actions), 23)
+        self.assertEqual(actions[-1]['id'], 'wine-23')
+
+    def test_wine_details(self):
+        server = StubServer(wine_detail_payload)
+        snooth = server.point(AsyncSnoothClient(api_key='stub'))
+        wine_ids = ['wine-1', 'bad-2', 'wine-3', 'wine-4']
+        try:
+            wines, errors = self.run_async(
+                snooth.wine_details(wine_ids, workers=2)
+            )
+            results = self.collect(
+                snooth.iter_wine_details(wine_ids, workers=2)
+            )
+        finally:
+            self.run_async(snooth.close())
+            server.stop()
+        self.assertEqual(wines[0]['code'], 'wine-1')
+        self.assertTrue(wines[1] is None)
+        self.assertEqual(list(errors), ['bad-2'])
+        self.assertEqual(sorted(r[0] for r in results), sorted(wine_ids))
+        for wine_id, wine, error in results:
+            self.assertEqual(error is None, not wine_id.startswith('bad'))
+
+    def test_retry(self):
+        self.snooth.retry = RetryPolicy(retries=2, backoff=0.01)
+        self.server.failures = [503, 503]
+        response = self.run_async(self.snooth.wine_detail('x'))
+        self.assertEqual(response['code'], 'chateau-recougne-2009')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_snooth_error(self):
+        self.server.payload = {
+            'meta': {'results': 0, 'errmsg': 'Invalid API key',
+                     'status': 0}
+        }
+        with self.assertRaises(SnoothError):
+            self.run_async(self.snooth.wine_detail('x'))
+
+    def test_http_error(self):
+        self.server.status = 500
+        with self.assertRaises(ClientResponseError) as context:
+            self.run_async(self.snooth.wine_search())
+        self.assertEqual(context.exception.status, 500)
+
+    def test_rate_wine_method(self):
+        with self.assertRaises(SnoothError):
+            self.run_async(self.snooth.rate_wine('x', method='GET'))
+
+    def test_unsupported_options(self):
+        self.assertRaises(SnoothError, AsyncSnoothClient, api_key='stub',
+                          observers=[Observer()])
+        self.assertRaises(SnoothError, AsyncSnoothClient, api_key='stub',
+                          revalidator=Revalidator())
+
+    def test_limiter_rejection_leaves_circuit_alone(self):
+        breaker = self.snooth.breaker = CircuitBreaker(failures=3)
+        self.snooth.limiter = RateLimiter(rate=1, burst=1, mode='fail')
+        self.snooth.limiter.reserve()
+        breaker.failure()
+        breaker.failure()
+        with self.assertRaises(RateLimitExceeded):
+            self.run_async(self.snooth.wine_search())
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""requests based HTTP stack, imported when a client sends its first
+request rather than when snoothclient is imported."""
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import timed_connection
+
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+class SnoothAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report how long they took to open to
+    the RequestEvent of the current call."""
+
+    _pool_classes = {}
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(SnoothAdapter, self).init_poolmanager(*args, **kwargs)
+        pool_classes = self.poolmanager.pool_classes_by_scheme
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: self._timed_pool(pool_class)
+            for (scheme, pool_class) in pool_classes.items()
+        }
+
+    @classmethod
+    def _timed_pool(cls, pool_class):
+        timed = cls._pool_classes.get(pool_class)
+        if timed is None:
+            timed = type(pool_class.__name__, (pool_class,), {
+                'ConnectionCls': timed_connection(pool_class.ConnectionCls)
+            })
+            cls._pool_classes[pool_class] = timed
+        return timed
+
+
+def http_session(pool_connections, pool_maxsize, pool_block, keep_alive):
+    session = requests.Session()
+    adapter = SnoothAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
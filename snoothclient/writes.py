@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from handlers import SnoothError
+from retry import RetryPolicy
+
+
+class Write(object):
+    """One queued rate_wine or wishlist call. ``seqs`` lists the journal
+    entries coalesced into it."""
+
+    __slots__ = ('kind', 'wine_id', 'params', 'seqs')
+
+    def __init__(self, kind, wine_id, params, seqs):
+        self.kind = kind
+        self.wine_id = wine_id
+        self.params = params
+        self.seqs = seqs
+
+    @property
+    def key(self):
+        return self.kind, self.params.get('username'), self.wine_id
+
+    def merge(self, other):
+        """Fold a later write for the same user and wine into this one,
+        its non None params win. A POST stays a POST."""
+        for field, value in other.params.items():
+            if value is not None and field != 'method':
+                self.params[field] = value
+        self.seqs.extend(other.seqs)
+
+
+class WriteQueue(object):
+    """Background sender for rate_wine and wishlist calls.
+
+    rate and wishlist return as soon as the write is queued. Writes for
+    the same user and wine still waiting to be sent are coalesced into
+    one, and ``workers`` threads send them in order of arrival, retrying
+    transient failures with ``retry``. Writes that still fail are kept in
+    ``failed`` with their exception.
+
+    With a ``spill`` path every queued write is journaled and fsynced
+    before rate or wishlist return and marked done once sent, so writes
+    still queued when the process dies are queued again by the next
+    WriteQueue opened on the same file. Journal lines are written outside
+    the queue lock and group committed: one fsync covers every line
+    buffered by then, and done marks ride along with the next one. A
+    write cut off mid send, or sent but not yet marked done on disk, is
+    sent again; delivery is at least once. The journal holds the users'
+    passwords and is created readable by its owner only.
+    """
+
+    def __init__(self, client, workers=4, retry=None, spill=None):
+        self.client = client
+        self.workers = workers
+        self.retry = retry or RetryPolicy()
+        self.spill = spill
+        self.sent = 0
+        self.failed = []
+        self._pending = OrderedDict()
+        self._inflight = {}
+        self._threads = []
+        self._closed = False
+        self._seq = 0
+        self._journal = None
+        self._lines = []
+        self._buffered = 0
+        self._synced = 0
+        self._condition = threading.Condition()
+        self._journal_lock = threading.Lock()
+        if spill is not None:
+            self._recover()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending) + len(self._inflight)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.drain()
+
+    def rate(self, wine_id, method='POST', username=None, password=None,
+             rating=None, review=None, private=False, tags=None,
+             wishlist=False, cellar_count=None):
+        """Queue a rate_wine call, same arguments bar the timeout."""
+        if method not in ('POST', 'PUT'):
+            raise SnoothError('Please use method="POST" or method="PUT".')
+        username, password = self.client._get_credentials(username,
+                                                          password)
+        self._put('rate', wine_id, {
+            'method': method, 'username': username, 'password': password,
+            'rating': rating, 'review': review, 'private': private,
+            'tags': tags, 'wishlist': wishlist, 'cellar_count': cellar_count
+        })
+
+    def wishlist(self, wine_id, username=None, password=None):
+        """Queue a wishlist call."""
+        username, password = self.client._get_credentials(username,
+                                                          password)
+        self._put('wishlist', wine_id,
+                  {'username': username, 'password': password})
+
+    def flush(self, timeout=None):
+        """Wait until every queued write was sent or gave up. Returns
+        False if ``timeout`` seconds passed first."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._pending or self._inflight:
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+        return True
+
+    def drain(self, timeout=None):
+        """Stop accepting writes, send the queued ones and stop the
+        workers. Returns False if ``timeout`` passed before all were
+        sent, those stay in the spill file."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        done = self.flush(timeout)
+        if done:
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+        with self._journal_lock:
+            if self._journal is not None:
+                with self._condition:
+                    self._compact()
+                    self._journal.close()
+                    self._journal = None
+        return done
+
+    def _put(self, kind, wine_id, params):
+        with self._condition:
+            if self._closed:
+                raise SnoothError('WriteQueue is drained')
+            self._seq += 1
+            write = Write(kind, wine_id, params, [self._seq])
+            ticket = None
+            if self._journal is not None:
+                ticket = self._log({'seq': self._seq, 'kind': kind,
+                                    'wine_id': wine_id, 'params': params})
+            self._enqueue(write)
+            self._start()
+            self._condition.notify()
+        if ticket is not None:
+            self._sync(ticket)
+
+    def _enqueue(self, write):
+        queued = self._pending.get(write.key)
+        if queued is None:
+            self._pending[write.key] = write
+        else:
+            queued.merge(write)
+
+    def _start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _next(self):
+        """Oldest pending write whose user and wine have no write in
+        flight, so writes to one wine go out in order."""
+        for key in self._pending:
+            if key not in self._inflight:
+                write = self._inflight[key] = self._pending.pop(key)
+                return write
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                write = self._next()
+                while write is None:
+                    if self._closed and not self._pending:
+                        return
+                    self._condition.wait()
+                    write = self._next()
+            error = self._send(write)
+            with self._condition:
+                self._inflight.pop(write.key, None)
+                if error is None:
+                    self.sent += 1
+                else:
+                    self.failed.append((write, error))
+                if self._journal is not None:
+                    self._log({'done': write.seqs})
+                self._condition.notify_all()
+
+    def _send(self, write):
+        params = dict(write.params)
+        attempt = 0
+        while True:
+            try:
+                if write.kind == 'rate':
+                    self.client.rate_wine(write.wine_id, **params)
+                else:
+                    self.client.wishlist(write.wine_id, **params)
+                return None
+            except Exception as error:
+                delay = self.retry.delay(attempt, error,
+                                         self.client.transient_errors(),
+                                         None)
+                if delay is None:
+                    return error
+                time.sleep(delay)
+                attempt += 1
+
+    def _recover(self):
+        """Queue the journaled writes never marked done and rewrite the
+        journal with just those."""
+        writes = OrderedDict()
+        if os.path.exists(self.spill):
+            with io.open(self.spill, 'rb') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        break
+                    if 'done' in entry:
+                        for seq in entry['done']:
+                            writes.pop(seq, None)
+                    else:
+                        writes[entry['seq']] = entry
+                        self._seq = max(self._seq, entry['seq'])
+        for seq, entry in writes.items():
+            self._enqueue(Write(entry['kind'], entry['wine_id'],
+                                entry['params'], [seq]))
+        self._compact()
+        if self._pending:
+            self._start()
+
+    def _compact(self):
+        entries = []
+        writes = list(self._inflight.values())
+        writes.extend(self._pending.values())
+        for write in writes:
+            for seq in write.seqs:
+                entries.append({'seq': seq, 'kind': write.kind,
+                                'wine_id': write.wine_id,
+                                'params': write.params})
+        # The rewrite covers anything still buffered.
+        self._lines = []
+        self._synced = self._buffered
+        if self._journal is not None:
+            self._journal.close()
+        temporary = self.spill + '.tmp'
+        descriptor = os.open(temporary,
+                             os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with io.open(descriptor, 'wb') as journal:
+            for entry in entries:
+                journal.write(self._encode(entry))
+            journal.flush()
+            os.fsync(journal.fileno())
+        getattr(os, 'replace', os.rename)(temporary, self.spill)
+        self._journal = io.open(self.spill, 'ab')
+
+    def _log(self, entry):
+        """Buffer a journal line, called holding the queue lock. Returns
+        the ticket _sync waits for."""
+        self._lines.append(self._encode(entry))
+        self._buffered += 1
+        return self._buffered
+
+    def _sync(self, ticket):
+        """Write and fsync buffered journal lines until the line numbered
+        ``ticket`` is on disk. Whoever holds the journal lock flushes every
+        line buffered so far, callers queued behind it usually find theirs
+        already written."""
+        with self._journal_lock:
+            if self._synced >= ticket:
+                return
+            with self._condition:
+                lines, self._lines = self._lines, []
+                buffered = self._buffered
+            if self._journal is not None:
+                self._journal.write(b''.join(lines))
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            self._synced = buffered
+
+    def _encode(self, entry):
+        return (json.dumps(entry, sort_keys=True) + '\n').encode('utf-8')